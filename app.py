@@ -3,16 +3,21 @@ import time
 import shutil
 from fastapi import Cookie
 from fastapi import Form
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, FileResponse, Response
 import hashlib
 import json
-import os, re, datetime, uuid, threading, decimal, io
+import pickle
+import os, re, sys, datetime, uuid, threading, decimal, io, bisect, select, struct, array, mmap, tempfile, csv, zlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import quote
 from typing import List, Optional, Dict
-from fastapi import FastAPI, Header, HTTPException, Depends
+from collections import OrderedDict
+from fastapi import FastAPI, Header, HTTPException, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 import pandas as pd
+import xlsx_stream
 
 app = FastAPI(title="PDF Search (auth on)")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
@@ -36,6 +41,35 @@ CONFIG: Dict = {
     "amount_numeric_equivalence": True,   # 金额数值等价
     "amount_zero_means_empty": True,      # 金额为0视为未填（忽略）
     "text_logic_or": False,               # 文本条件采用 AND（多条件都要命中）
+
+    # 文件变化监听（搜索时不再逐次扫描签名）
+    "watch_enabled": True,                # 启用 inotify 监听；关闭则每次搜索都做签名扫描
+    "watch_poll_interval": 5,             # 无 inotify 时的轮询间隔（秒）
+    "watch_rescan_interval": 60,          # 有 inotify 时的兜底全量轮询间隔（秒，NFS 远端变更收不到事件；0 关闭）
+
+    # 检索引擎："python" 逐行循环；"numpy" 列存向量化过滤（需 numpy，缺失时回退 python）
+    "search_engine": "python",
+    "text_index_enabled": True,           # 工程地点及内容/单位名称 子串检索走 bigram 倒排索引
+    "query_cache_entries": 256,           # 查询结果缓存条数上限（0 关闭）
+    "query_cache_max_ids": 2000000,       # 查询结果缓存行号总数上限
+    "max_staleness": 0,                   # 数据过期后最多继续提供旧结果的秒数，超过则等待后台重建（0 不限）
+    "parse_workers": 0,                   # 重建时并行解析工作簿的进程数（0 = CPU 核数；1 = 当前进程串行）
+    "xlsx_reader": "stream",              # .xlsx 读取："stream" 流式解析 sheet XML（不支持的结构自动回退）；"openpyxl"
+    "parse_retry_interval": 30,           # 工作簿读取失败（权限、复制未完成等）后多少秒重试，失败分区不缓存不落盘
+
+    # 多 worker（start.sh 中 PDFSEARCH_WORKERS>1）：行缓存发布为 DATA/rows_shared.bin，各进程 mmap 共享；
+    # /api/mdirs/reload 的配置经 DATA/index_config.json 同步到所有进程
+    "shared_snapshot": int(os.environ.get("PDFSEARCH_WORKERS", "1") or 1) > 1,
+    # "inline" Web 进程自行解析；"external" 由 bin/indexer.py 解析并发布，Web 进程只映射最新发布的快照
+    "indexer": os.environ.get("PDFSEARCH_INDEXER", "inline"),
+
+    # 异步导出任务（/api/export/jobs）：导出文件缓存在 DATA/exports，键 = 查询条件 + 格式 + 数据签名
+    "export_workers": 2,                  # 同时执行的导出任务数
+    "export_cache_max_mb": 1024,          # 导出文件缓存总大小上限，超出按最久未用淘汰
+    "export_cache_max_age_hours": 24,     # 导出文件最长保留时间
+
+    # 备注先写入 DATA/remarks_journal.jsonl（fsync），再按批写回各 index.xlsx
+    "remark_flush_delay": 5,              # 收到备注后等待多少秒再批量写回（期间的备注合并为每个工作簿一次保存）
 }
 
 RETURN_FIELDS = ["序号","工程地点及内容","单位名称","签订日期","合同额","结算值","已付款","欠付款","合同编号","pdf_path","pdf_dl"]
@@ -128,22 +162,77 @@ def _set_auto_update_enabled(enabled: bool) -> None:
         _save_auto_update_enabled(AUTO_UPDATE_ENABLED)
 
 def _get_auto_update_enabled() -> bool:
+    # 开关可能由其他 worker 切换：以 auto_update.json 为准
+    global AUTO_UPDATE_ENABLED
     with AUTO_UPDATE_LOCK:
+        AUTO_UPDATE_ENABLED = _load_auto_update_enabled()
         return bool(AUTO_UPDATE_ENABLED)
 
-# 轻量 rows 缓存（按 Excel 列表+mtime 签名）
-_ROWS_CACHE = {"sig": None, "rows": []}
+# 轻量 rows 缓存（按 Excel 列表+mtime 签名）：view 为当前不可变视图 {sig, rows, derived, version, built_at}；
+# parts 为按工作簿划分的分区 {path: {sig, rows}}；dirty_gen != clean_gen 表示被显式标记过期
+_ROWS_CACHE = {"view": None, "parts": {}, "version": 0, "dirty_gen": 0, "clean_gen": 0, "stale_since": None}
 _ROWS_LOCK = threading.Lock()
 
 def _utc_now_ts() -> float: return datetime.datetime.utcnow().timestamp()
+
+# 令牌同时写入 DATA/tokens/<token>（内容为过期时间戳），多个 worker 进程共用；TOKENS 为进程内缓存
+_TOKEN_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+def _token_dir() -> str:
+    return os.path.join(_resolve_data_dir(), "tokens")
+
+def _store_token(tok: str, expires: float) -> None:
+    d = _token_dir()
+    try:
+        os.makedirs(d, mode=0o700, exist_ok=True)
+        path = os.path.join(d, tok)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(repr(expires))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def _lookup_token(tok: str) -> Optional[float]:
+    expires = TOKENS.get(tok)
+    if expires is not None or not _TOKEN_RE.match(tok):
+        return expires
+    try:
+        with open(os.path.join(_token_dir(), tok), "r", encoding="utf-8") as f:
+            expires = float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    TOKENS[tok] = expires
+    return expires
+
+def _drop_token(tok: str) -> None:
+    TOKENS.pop(tok, None)
+    if _TOKEN_RE.match(tok):
+        try:
+            os.remove(os.path.join(_token_dir(), tok))
+        except OSError:
+            pass
+
+def _purge_expired_tokens() -> None:
+    now = _utc_now_ts()
+    try:
+        names = os.listdir(_token_dir())
+    except OSError:
+        return
+    for name in names:
+        if _TOKEN_RE.match(name) and (_lookup_token(name) or 0) < now:
+            _drop_token(name)
+
 def _issue_token(hours=24) -> str:
-    t = str(uuid.uuid4()); TOKENS[t] = (_utc_now_ts() + hours*3600); return t
+    _purge_expired_tokens()
+    t = str(uuid.uuid4()); TOKENS[t] = (_utc_now_ts() + hours*3600); _store_token(t, TOKENS[t]); return t
 def require_auth(x_auth: str = Header(None), X_Auth: str = Cookie(None)):
     tok = x_auth or X_Auth
-    if not tok or tok not in TOKENS:
+    expires = _lookup_token(tok) if tok else None
+    if expires is None:
         raise HTTPException(401, "Unauthorized")
-    if TOKENS[tok] < _utc_now_ts():
-        TOKENS.pop(tok, None)
+    if expires < _utc_now_ts():
+        _drop_token(tok)
         raise HTTPException(401, "Token expired")
     return tok
 
@@ -206,38 +295,67 @@ def _iter_excel_files(root: str):
     except FileNotFoundError:
         return
 
-def _gather_excel_files():
-    """返回 (files_in_order, signature)：
+# 影响单个工作簿解析结果的配置项（计入文件签名，并传给解析子进程）
+_PARSE_CFG_KEYS = ("allowed_exts", "pdf_subdirs", "public_base", "preview_prefix", "download_prefix", "xlsx_reader")
+
+def _gather_root(root: str) -> Optional[Dict]:
+    """单个 root 的签名素材：{"files": [(excel_path, mtime_ns, size)], "dirs": [(dir_path, mtime_ns, count)], "file_sigs": {excel_path: sig}}；
+    root 不存在返回 None"""
+    if not os.path.isdir(root):
+        return None
+    pdf_subdirs = CONFIG.get("pdf_subdirs", [])
+    parse_cfg = [CONFIG.get(k) for k in _PARSE_CFG_KEYS]
+    files=[]
+    dirs=[]
+    file_sigs={}
+    # 目录签名：root 以及其 pdf_subdirs（存在才统计）
+    for d in [root] + [os.path.join(root, sd) for sd in (pdf_subdirs or [])]:
+        if os.path.isdir(d):
+            try:
+                st = os.stat(d)
+                mns = int(getattr(st, "st_mtime_ns", int(st.st_mtime*1e9)))
+                try:
+                    cnt = len(os.listdir(d))
+                except Exception:
+                    cnt = -1
+                dirs.append((d, mns, cnt))
+            except Exception:
+                dirs.append((d, 0, -1))
+    # Excel 清单
+    for x in _iter_excel_files(root):
+        try:
+            st = os.stat(x)
+            mns = int(getattr(st, "st_mtime_ns", int(st.st_mtime*1e9)))
+            entry = (x, mns, st.st_size)
+        except Exception:
+            entry = (x, 0, 0)
+        files.append(entry)
+        file_payload = json.dumps([entry, dirs, parse_cfg], ensure_ascii=False)
+        file_sigs[x] = hashlib.sha1(file_payload.encode("utf-8")).hexdigest()
+    return {"files": files, "dirs": dirs, "file_sigs": file_sigs}
+
+def _gather_excel_files(root_results: Optional[Dict[str, Optional[Dict]]] = None):
+    """返回 (files_in_order, signature, file_sigs)：
     files_in_order：按 CONFIG["roots"] 与 _iter_excel_files 顺序收集到的 Excel 路径
     signature：对 (Excel清单: 路径,mtime_ns,size) + (PDF目录清单: 路径,mtime_ns,项数) + excel_patterns 做摘要
+    file_sigs：每个 Excel 的独立签名 = 自身 (mtime_ns,size) + 所在 root 的 PDF 目录清单 + 影响解析结果的配置
+    root_results：可选的 {root: _gather_root 结果}，已有的 root 直接复用（不再访问文件系统），新采集的写回其中
     """
     files=[]    # [(excel_path, mtime_ns, size)]
     dirs=[]     # [(dir_path, mtime_ns, count)]
-    pdf_subdirs = CONFIG.get("pdf_subdirs", [])
+    file_sigs={}
     for root in CONFIG.get("roots", []):
-        if not os.path.isdir(root):
+        if root_results is not None and root in root_results:
+            res = root_results[root]
+        else:
+            res = _gather_root(root)
+            if root_results is not None:
+                root_results[root] = res
+        if res is None:
             continue
-        # 目录签名：root 以及其 pdf_subdirs（存在才统计）
-        for d in [root] + [os.path.join(root, sd) for sd in (pdf_subdirs or [])]:
-            if os.path.isdir(d):
-                try:
-                    st = os.stat(d)
-                    mns = int(getattr(st, "st_mtime_ns", int(st.st_mtime*1e9)))
-                    try:
-                        cnt = len(os.listdir(d))
-                    except Exception:
-                        cnt = -1
-                    dirs.append((d, mns, cnt))
-                except Exception:
-                    dirs.append((d, 0, -1))
-        # Excel 清单
-        for x in _iter_excel_files(root):
-            try:
-                st = os.stat(x)
-                mns = int(getattr(st, "st_mtime_ns", int(st.st_mtime*1e9)))
-                files.append((x, mns, st.st_size))
-            except Exception:
-                files.append((x, 0, 0))
+        dirs.extend(res["dirs"])
+        files.extend(res["files"])
+        file_sigs.update(res["file_sigs"])
     # 稳定排序后摘要
     sig_files = sorted(files, key=lambda t: t[0].lower())
     sig_dirs  = sorted(dirs,  key=lambda t: t[0].lower())
@@ -247,7 +365,7 @@ def _gather_excel_files():
         "excel_patterns": CONFIG.get("excel_patterns", [])
     }, ensure_ascii=False, sort_keys=True)
     sig = hashlib.sha1(payload.encode("utf-8")).hexdigest()
-    return [f[0] for f in files], sig
+    return [f[0] for f in files], sig, file_sigs
 def _normalize_amount_to_decimal(s: str):
     """金额数值等价（去货币符号/千分位/空格；仅保留0-9.-）；0 视为未填（可配置）"""
     if s is None: return None
@@ -266,34 +384,59 @@ def _normalize_amount_to_decimal(s: str):
         return None
     return val
 
-def _find_pdf(root, base, exts, subdirs):
-    """在 root、root/subdir 下找 PDF：完整等于 base.ext；或“以 base 开头”的 pdf；大小写不敏感"""
-    if not base: return ""
+def _scan_pdf_dir(d: str) -> Optional[Dict]:
+    """一次 os.scandir 建立目录文件名索引：exact 原名→mtime_ns；lower 小写名→(原名, mtime_ns)（先出现者优先）；
+    sorted 为小写名有序列表，供 bisect 前缀查找。目录不存在返回 None"""
+    exact = {}
+    lower = {}
+    try:
+        with os.scandir(d) as it:
+            for entry in it:
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    mns = int(getattr(st, "st_mtime_ns", int(st.st_mtime*1e9)))
+                except OSError:
+                    continue
+                exact[entry.name] = mns
+                lower.setdefault(entry.name.lower(), (entry.name, mns))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return {"dir": d, "exact": exact, "lower": lower, "sorted": sorted(lower)}
+
+def _build_pdf_index(root: str, subdirs) -> List[Dict]:
+    """root 及 root/subdir 的文件名索引（按此顺序查找）"""
+    cand_dirs = [root] + [os.path.join(root, sd) for sd in (subdirs or [])]
+    return [idx for idx in (_scan_pdf_dir(d) for d in cand_dirs) if idx is not None]
+
+def _lookup_pdf(pdf_index: List[Dict], base, exts):
+    """在预建索引（root、root/subdir 依次）中找 PDF，返回 (路径, mtime_ns)，未命中返回 ("", None)。
+    每个目录先找完整等于 base.ext 的文件（先区分大小写，再忽略大小写），再找“以 base 开头”的 .pdf（大小写不敏感）"""
+    if not base: return "", None
     base = str(base).strip()
-    if not base: return ""
-    cand_dirs = [root]
-    for sd in (subdirs or []):
-        cand_dirs.append(os.path.join(root, sd))
-    for d in cand_dirs:
-        try:
-            # 1) 完全等于 base.ext（大小写忽略）
-            for ext in exts:
-                p=os.path.join(d, f"{base}{ext}")
-                if os.path.isfile(p): return p
-                low=f"{base}{ext}".lower()
-                for name in os.listdir(d):
-                    if name.lower()==low and name.lower().endswith(ext.lower()):
-                        q=os.path.join(d, name)
-                        if os.path.isfile(q): return q
-            # 2) 以 base 开头的 *.pdf
-            for name in os.listdir(d):
-                ln=name.lower()
-                if ln.endswith(".pdf") and ln.startswith(base.lower()):
-                    q=os.path.join(d, name)
-                    if os.path.isfile(q): return q
-        except FileNotFoundError:
-            continue
-    return ""
+    if not base: return "", None
+    base_low = base.lower()
+    for idx in pdf_index:
+        d = idx["dir"]
+        # 1) 完全等于 base.ext（先区分大小写，再忽略大小写）
+        for ext in exts:
+            name = f"{base}{ext}"
+            if name in idx["exact"]:
+                return os.path.join(d, name), idx["exact"][name]
+            low = name.lower()
+            hit = idx["lower"].get(low)
+            if hit and low.endswith(ext.lower()):
+                return os.path.join(d, hit[0]), hit[1]
+        # 2) 以 base 开头的 *.pdf（有序列表二分定位前缀区间）
+        names = idx["sorted"]
+        i = bisect.bisect_left(names, base_low)
+        while i < len(names) and names[i].startswith(base_low):
+            if names[i].endswith(".pdf"):
+                hit = idx["lower"][names[i]]
+                return os.path.join(d, hit[0]), hit[1]
+            i += 1
+    return "", None
 
 
 
@@ -324,6 +467,8 @@ def _build_header_map(headers: list[str]) -> dict[int, str]:
             colmap[idx] = "单位名称"
         if k in ["签订日期", "日期", "签署日期"]:
             colmap[idx] = "签订日期"
+        if k in ["控制价", "控制金额"]:
+            colmap[idx] = "控制价"
         if k in ["合同额", "金额", "合同金额"]:
             colmap[idx] = "合同额"
         if k in ["结算值", "结算金额"]:
@@ -340,122 +485,303 @@ def _build_header_map(headers: list[str]) -> dict[int, str]:
             colmap[idx] = "欠付款"
     return colmap
 
-def _load_all_rows():
-    # —— 轻量缓存：按 Excel 清单 + (mtime,size) 签名 —— 
-    files, sig = _gather_excel_files()
-    with _ROWS_LOCK:
-        if _ROWS_CACHE.get("sig") == sig:
-            return list(_ROWS_CACHE.get("rows", []))
-
-    rows=[]
-    rows_by_key={}
-    for x in files:
-        scan_root = os.path.dirname(x)
-        ext = os.path.splitext(x)[1].lower()
-
-        if ext == '.xlsx':
+def _pdf_public_urls(pdf_guess: str, mtime_ns: Optional[int]=None):
+    """PDF 绝对路径 → (预览地址, 下载地址)；不在 public_base 下则返回空串。mtime_ns 已知时不再 stat"""
+    if not pdf_guess:
+        return "", ""
+    public_base = CONFIG.get("public_base","/data/contracts")
+    prev = CONFIG.get("preview_prefix","/files/")
+    down = CONFIG.get("download_prefix","/dl/")
+    try:
+        rel = os.path.relpath(pdf_guess, public_base).replace("\\","/")
+        if rel.startswith("../"):
+            return "", ""
+        if mtime_ns is not None:
+            qs = f"?v={mtime_ns}"
+        else:
             try:
-                from openpyxl import load_workbook
-                wb = load_workbook(x, read_only=True, data_only=True)
-                ws = wb.active
-                header_cells = list(ws[1])
-                headers = ["" if c.value is None else str(c.value).strip() for c in header_cells]
-                col_idx_map = _build_header_map(headers)
-                for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-                    item = {}
-                    for col_idx, cell in enumerate(row):
-                        canonical = col_idx_map.get(col_idx)
-                        if not canonical:
-                            continue
-                        if canonical not in ["序号","工程地点及内容","单位名称","签订日期","合同额","结算值","已付款","欠付款","合同编号"]:
-                            continue
-                        raw_val = "" if cell.value is None else str(cell.value).strip()
-                        item[canonical] = raw_val
-                        if canonical in MONEY_FIELDS:
-                            money_nf = item.setdefault("__money_number_formats", {})
-                            money_nf[canonical] = cell.number_format or ""
-                    item["签订日期_norm"] = _norm_date(item.get("签订日期",""))
-                    item["__source_file"] = x
-                    item["__row_index"] = row_idx
-
-                    base = (item.get("序号") or item.get("合同编号","") or "").strip()
-                    if not base:
-                        continue
-                    pdf_guess = _find_pdf(scan_root, base, CONFIG.get("allowed_exts", [".pdf"]), CONFIG.get("pdf_subdirs", ["DOCS","docs"]))
-
-                    item["pdf_path"] = ""; item["pdf_dl"] = ""
-                    if pdf_guess:
-                        public_base = CONFIG.get("public_base","/data/contracts")
-                        prev = CONFIG.get("preview_prefix","/files/")
-                        down = CONFIG.get("download_prefix","/dl/")
-                        try:
-                            rel = os.path.relpath(pdf_guess, public_base).replace("\\","/")
-                            if not rel.startswith("../"):
-                                try:
-                                    st = os.stat(pdf_guess)
-                                    mns = int(getattr(st, 'st_mtime_ns', int(st.st_mtime*1e9)))
-                                    qs = f"?v={mns}"
-                                except Exception:
-                                    qs = ""
-                                item["pdf_path"] = prev + rel + qs
-                                item["pdf_dl"]   = down + rel + qs
-                        except Exception:
-                            pass
-                    dedup_key = base
-                    existing_idx = rows_by_key.get(dedup_key)
-                    if existing_idx is not None:
-                        existing = rows[existing_idx]
-                        if existing.get("pdf_path") and not item.get("pdf_path"):
-                            continue
-                        if item.get("pdf_path") and not existing.get("pdf_path"):
-                            rows[existing_idx] = item
-                        continue
-                    rows_by_key[dedup_key] = len(rows)
-                    rows.append(item)
-                wb.close()
-                continue
+                st = os.stat(pdf_guess)
+                mns = int(getattr(st, 'st_mtime_ns', int(st.st_mtime*1e9)))
+                qs = f"?v={mns}"
             except Exception:
-                pass
+                qs = ""
+        return prev + rel + qs, down + rel + qs
+    except Exception:
+        return "", ""
+
+def _finish_row_item(item: dict, x: str, row_idx: int, pdf_index: List[Dict]) -> Optional[dict]:
+    """补齐派生字段（日期规范化、来源、PDF 链接）；无 序号/合同编号 的行返回 None"""
+    item["签订日期_norm"] = _norm_date(item.get("签订日期",""))
+    item["__source_file"] = x
+    item["__row_index"] = row_idx
+
+    base = (item.get("序号") or item.get("合同编号","") or "").strip()
+    if not base:
+        return None
+    pdf_guess, pdf_mtime = _lookup_pdf(pdf_index, base, CONFIG.get("allowed_exts", [".pdf"]))
+    item["pdf_path"], item["pdf_dl"] = _pdf_public_urls(pdf_guess, pdf_mtime)
+    _attach_typed_columns(item)
+    return item
+
+def _attach_typed_columns(item: dict) -> None:
+    """加载时一次性算好检索用的类型化列：__cents 各金额字段的分值，__date_std/__ymd 规范日期及 (年,月,日) 整数，__settled 结清标记"""
+    item["__cents"] = {f: _amount_to_cents(item.get(f, "")) for f in MONEY_FIELDS}
+    date_std = _norm_in_date_std(_norm_in_date(item.get("签订日期_norm", "") or item.get("签订日期", "")))
+    item["__date_std"] = date_std
+    item["__ymd"] = _date_parts(date_std)
+    item["__settled"] = _is_settled_row(item)
+
+def _amount_to_cents(value):
+    """金额 → 以分为单位的 int；超过两位小数时保留精确的 Decimal（×100），保证等值比较语义不变；空/非法返回 None"""
+    d = _try_parse_amount_decimal(value)
+    if d is None:
+        return None
+    cents = d * 100
+    return int(cents) if cents == cents.to_integral_value() else cents
+
+def _date_parts(date_std: str):
+    """'YYYY-' / 'YYYY-MM' / 'YYYY-MM-DD' → (年, 月, 日)，缺失部分为 0；无法识别年份返回 None"""
+    if len(date_std) < 4 or not date_std[:4].isdigit():
+        return None
+    y = int(date_std[:4]); m = d = 0
+    if len(date_std) >= 7 and date_std[4] == '-' and date_std[5:7].isdigit():
+        m = int(date_std[5:7])
+        if len(date_std) == 10 and date_std[7] == '-' and date_std[8:10].isdigit():
+            d = int(date_std[8:10])
+    return (y, m, d)
+
+# 行缓存从 Excel 读取的字段
+_PARSE_FIELDS = ["序号","工程地点及内容","单位名称","签订日期","控制价","合同额","结算值","已付款","欠付款","合同编号"]
+
+# —— 详情行存储：解析时顺带保存每行全部列（含未映射列与 备注）的展示值，/api/entry/detail 直接从内存应答 ——
+# {"stat": (mtime_ns, size), "headers": 表头, "cols": 非空表头的列下标, "rows": {行号: 展示值元组}, "max_row": 末行号}
+# 金额列保存 (原值, 数字格式)，取用时再格式化（解析时逐格格式化金额代价高）；全空的行不保存；stat 与文件当前状态不符时视为失效
+
+def _detail_begin(detail: Dict, headers: List[str]) -> None:
+    detail["headers"] = headers
+    detail["cols"] = [i for i, h in enumerate(headers) if h]
+    detail["rows"] = {}
+    detail["max_row"] = 1
+    detail["entries"] = 0   # 首列非空的数据行数（/api/entries/count）
+
+def _detail_add(detail: Dict, row_idx: int, cell_at) -> None:
+    """cell_at(列下标) → (值, 数字格式)"""
+    headers = detail["headers"]
+    first = cell_at(0)[0]
+    if first is not None and first != "":
+        detail["entries"] += 1
+    values = []
+    for i in detail["cols"]:
+        raw, number_format = cell_at(i)
+        if raw is None:
+            values.append("")
+        elif headers[i] in MONEY_FIELDS:
+            values.append((raw, number_format))
+        else:
+            values.append(_format_cell_for_display(headers[i], raw))
+    if any(values):
+        detail["rows"][row_idx] = tuple(values)
+
+def _detail_add_stream(detail: Dict, row_idx: int, sheet: Dict, cells: Dict) -> None:
+    """xlsx_stream 行：单元格为 (值, 样式下标)，只有金额列取数字格式"""
+    _detail_add(detail, row_idx, lambda i: (None, None) if i not in cells else
+                (cells[i][0], xlsx_stream.number_format(sheet, cells[i][1])))
+
+def _detail_display(header: str, value) -> str:
+    if isinstance(value, tuple):
+        return _format_cell_for_display(header, value[0], value[1])
+    return value
+
+def _parse_xlsx_stream(x: str, pdf_index: List[Dict], detail: Optional[Dict] = None) -> List[dict]:
+    """xlsx_stream 读取活动工作表，只取映射到 _PARSE_FIELDS 的列（传入 detail 时读全部列并填充详情行存储）；
+    结果与 openpyxl read_only 路径逐行一致"""
+    sheet = xlsx_stream.open_active_sheet(x)
+    try:
+        headers = ["" if v is None else str(v).strip() for v in xlsx_stream.read_header(sheet)]
+        wanted = {c: canonical for c, canonical in sorted(_build_header_map(headers).items()) if canonical in _PARSE_FIELDS}
+        if detail is not None:
+            _detail_begin(detail, headers)
+        items = []
+        last_row = 1
+        for row_idx, width, cells in xlsx_stream.iter_rows(sheet, wanted if detail is None else None, min_row=2):
+            last_row = row_idx
+            if detail is not None:
+                _detail_add_stream(detail, row_idx, sheet, cells)
+            item = {}
+            for col_idx, canonical in wanted.items():
+                if col_idx >= width:
+                    break
+                cell = cells.get(col_idx)
+                value = None if cell is None else cell[0]
+                item[canonical] = "" if value is None else str(value).strip()
+                if canonical in MONEY_FIELDS:
+                    money_nf = item.setdefault("__money_number_formats", {})
+                    money_nf[canonical] = (xlsx_stream.number_format(sheet, cell[1]) if cell is not None else None) or ""
+            item = _finish_row_item(item, x, row_idx, pdf_index)
+            if item is not None:
+                items.append(item)
+        if detail is not None:
+            detail["max_row"] = sheet["dims"][3] if sheet["dims"] is not None else last_row
+        return items
+    finally:
+        xlsx_stream.close(sheet)
+
+def _read_detail_store(x: str) -> Optional[Dict]:
+    """单独读取一个工作簿的详情行存储（内存中没有或已失效时）；读不了返回 None"""
+    try:
+        st = os.stat(x)
+    except OSError:
+        return None
+    detail = {"stat": (st.st_mtime_ns, st.st_size)}
+    if os.path.splitext(x)[1].lower() != ".xlsx":
+        return None
+    try:
+        sheet = xlsx_stream.open_active_sheet(x)
+        try:
+            _detail_begin(detail, ["" if v is None else str(v).strip() for v in xlsx_stream.read_header(sheet)])
+            last_row = 1
+            for row_idx, width, cells in xlsx_stream.iter_rows(sheet, None, min_row=2):
+                last_row = row_idx
+                _detail_add_stream(detail, row_idx, sheet, cells)
+            detail["max_row"] = sheet["dims"][3] if sheet["dims"] is not None else last_row
+            return detail
+        finally:
+            xlsx_stream.close(sheet)
+    except Exception:
+        pass
+    try:
+        from openpyxl import load_workbook
+        wb = load_workbook(x, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            _detail_begin(detail, ["" if c.value is None else str(c.value).strip() for c in ws[1]])
+            last_row = 1
+            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
+                last_row = row_idx
+                _detail_add(detail, row_idx, lambda i: (row[i].value, row[i].number_format) if i < len(row) else (None, None))
+            detail["max_row"] = ws.max_row or last_row
+            return detail
+        finally:
+            wb.close()
+    except Exception:
+        return None
 
+def _parse_excel_partition(x: str) -> Dict:
+    """解析单个 Excel → {"rows": 条目, "detail": 详情行存储（.xls 等无法保存时为 None）,
+    "error": 所有读取方式都失败时的异常描述（否则 None）}"""
+    try:
+        st = os.stat(x)
+        detail = {"stat": (st.st_mtime_ns, st.st_size)}
+    except OSError:
+        detail = {}
+    rows = _parse_excel_file(x, detail)
+    return {"rows": rows, "detail": detail if "headers" in detail else None, "error": detail.get("error")}
+
+def _parse_excel_file(x: str, detail: Optional[Dict] = None) -> List[dict]:
+    """解析单个 Excel，按行顺序返回条目（未跨文件去重）；传入 detail 时顺带填充详情行存储，
+    所有读取方式都失败时在 detail["error"] 记录原因"""
+    scan_root = os.path.dirname(x)
+    ext = os.path.splitext(x)[1].lower()
+    items = []
+    # 每个工作簿只扫描一次 PDF 目录，逐行查索引
+    pdf_index = _build_pdf_index(scan_root, CONFIG.get("pdf_subdirs", ["DOCS","docs"]))
+
+    if ext == '.xlsx' and CONFIG.get("xlsx_reader", "stream") == "stream":
         try:
-            df = pd.read_excel(x, dtype=str).fillna("")
+            return _parse_xlsx_stream(x, pdf_index, detail)
+        except Exception as exc:
+            # Unsupported 是预期的结构性回退；其他异常多半是读取器缺陷，记录后同样回退
+            if not isinstance(exc, xlsx_stream.Unsupported):
+                _auto_update_log(f"流式读取失败，改用 openpyxl: {x} ({exc!r})")
+            if detail is not None:
+                for k in ("headers", "cols", "rows", "max_row", "entries"):
+                    detail.pop(k, None)
+
+    if ext == '.xlsx':
+        try:
+            from openpyxl import load_workbook
+            wb = load_workbook(x, read_only=True, data_only=True)
+            ws = wb.active
+            header_cells = list(ws[1])
+            headers = ["" if c.value is None else str(c.value).strip() for c in header_cells]
+            col_idx_map = _build_header_map(headers)
+            if detail is not None:
+                _detail_begin(detail, headers)
+            last_row = 1
+            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
+                last_row = row_idx
+                if detail is not None:
+                    _detail_add(detail, row_idx, lambda i: (row[i].value, row[i].number_format) if i < len(row) else (None, None))
+                item = {}
+                for col_idx, cell in enumerate(row):
+                    canonical = col_idx_map.get(col_idx)
+                    if not canonical:
+                        continue
+                    if canonical not in _PARSE_FIELDS:
+                        continue
+                    raw_val = "" if cell.value is None else str(cell.value).strip()
+                    item[canonical] = raw_val
+                    if canonical in MONEY_FIELDS:
+                        money_nf = item.setdefault("__money_number_formats", {})
+                        money_nf[canonical] = cell.number_format or ""
+                item = _finish_row_item(item, x, row_idx, pdf_index)
+                if item is not None:
+                    items.append(item)
+            if detail is not None:
+                detail["max_row"] = ws.max_row or last_row
+            wb.close()
+            return items
         except Exception:
-            continue
-        col_idx_map = _build_header_map([str(c).strip() for c in df.columns])
-        colmap = {c: col_idx_map[i] for i, c in enumerate(df.columns) if i in col_idx_map}
-        if colmap:
-            df = df.rename(columns=colmap)
-
-        for row_idx, (_, r) in enumerate(df.iterrows(), start=2):
-            item={k:("" if r.get(k, "") is None else str(r.get(k, "")).strip()) for k in ["序号","工程地点及内容","单位名称","签订日期","合同额","结算值","已付款","欠付款","合同编号"] if k in df.columns}
-            item["签订日期_norm"] = _norm_date(item.get("签订日期",""))
-            item["__source_file"] = x
-            item["__row_index"] = row_idx
-
-            base = (item.get("序号") or item.get("合同编号","") or "").strip()
-            if not base:
-                continue
-            pdf_guess = _find_pdf(scan_root, base, CONFIG.get("allowed_exts", [".pdf"]), CONFIG.get("pdf_subdirs", ["DOCS","docs"]))
+            items = []
+            if detail is not None:
+                for k in ("headers", "cols", "rows", "max_row", "entries"):
+                    detail.pop(k, None)
 
-            item["pdf_path"] = ""; item["pdf_dl"] = ""
-            if pdf_guess:
-                public_base = CONFIG.get("public_base","/data/contracts")
-                prev = CONFIG.get("preview_prefix","/files/")
-                down = CONFIG.get("download_prefix","/dl/")
-                try:
-                    rel = os.path.relpath(pdf_guess, public_base).replace("\\","/")
-                    if not rel.startswith("../"):
-                        try:
-                            st = os.stat(pdf_guess)
-                            mns = int(getattr(st, 'st_mtime_ns', int(st.st_mtime*1e9)))
-                            qs = f"?v={mns}"
-                        except Exception:
-                            qs = ""
-                        item["pdf_path"] = prev + rel + qs
-                        item["pdf_dl"]   = down + rel + qs
-                except Exception:
-                    pass
-            dedup_key = base
+    try:
+        df = pd.read_excel(x, dtype=str).fillna("")
+    except Exception as exc:
+        if detail is not None:
+            detail["error"] = repr(exc)
+        return items
+    col_idx_map = _build_header_map([str(c).strip() for c in df.columns])
+    colmap = {c: col_idx_map[i] for i, c in enumerate(df.columns) if i in col_idx_map}
+    if colmap:
+        df = df.rename(columns=colmap)
+
+    for row_idx, (_, r) in enumerate(df.iterrows(), start=2):
+        item={k:("" if r.get(k, "") is None else str(r.get(k, "")).strip()) for k in _PARSE_FIELDS if k in df.columns}
+        item = _finish_row_item(item, x, row_idx, pdf_index)
+        if item is not None:
+            items.append(item)
+    return items
+
+def _parse_worker_init(cfg: Dict) -> None:
+    # spawn 出来的子进程重新导入本模块，CONFIG 为默认值：套用父进程当前的解析配置
+    CONFIG.update(cfg)
+
+def _parse_excel_files(paths: List[str]) -> Dict[str, Dict]:
+    """解析多个工作簿 → {path: {"rows", "detail"}}。多于一个文件时分发到进程池（spawn：父进程有监听/请求线程，不能 fork），
+    池随本次重建创建和回收；子进程不可用时回退为串行"""
+    workers = int(CONFIG.get("parse_workers", 0) or 0)
+    workers = min(workers if workers > 0 else (os.cpu_count() or 1), len(paths))
+    if workers <= 1:
+        return {x: _parse_excel_partition(x) for x in paths}
+    cfg = {k: CONFIG.get(k) for k in _PARSE_CFG_KEYS}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_parse_worker_init, initargs=(cfg,)) as pool:
+            futures = {x: pool.submit(_parse_excel_partition, x) for x in paths}
+            return {x: f.result() for x, f in futures.items()}
+    except Exception:
+        return {x: _parse_excel_partition(x) for x in paths}
+
+def _merge_rows(parts: List[List[dict]]) -> List[dict]:
+    """按文件顺序合并；同一 序号/合同编号 只保留一条，有 PDF 的优先"""
+    rows=[]
+    rows_by_key={}
+    for items in parts:
+        for item in items:
+            dedup_key = (item.get("序号") or item.get("合同编号","") or "").strip()
             existing_idx = rows_by_key.get(dedup_key)
             if existing_idx is not None:
                 existing = rows[existing_idx]
@@ -466,11 +792,837 @@ def _load_all_rows():
                 continue
             rows_by_key[dedup_key] = len(rows)
             rows.append(item)
+    return rows
+
+# 磁盘行快照：按 Excel 路径保存 {sig, rows, detail}，重启后只重解析签名变化的工作簿
+_ROWS_SNAPSHOT_VERSION = 5
+
+def _rows_snapshot_path() -> str:
+    return os.path.join(_resolve_data_dir(), "rows_snapshot.pkl")
 
+def _load_rows_snapshot() -> Dict[str, Dict]:
+    try:
+        with open(_rows_snapshot_path(), "rb") as f:
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        return {}
+    if not isinstance(payload, dict) or payload.get("version") != _ROWS_SNAPSHOT_VERSION:
+        return {}
+    files = payload.get("files")
+    return files if isinstance(files, dict) else {}
+
+def _save_rows_snapshot(files: Dict[str, Dict]) -> None:
+    path = _rows_snapshot_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"version": _ROWS_SNAPSHOT_VERSION, "files": files}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+def _process_lock(name: str, blocking: bool = True):
+    """跨进程互斥（flock，DATA/<name>）：返回已加锁的文件对象，close 即释放；非阻塞且被占用时返回 None。
+    无 fcntl 的平台不加锁"""
+    data_dir = _resolve_data_dir()
+    os.makedirs(data_dir, exist_ok=True)
+    fh = open(os.path.join(data_dir, name), "a+")
+    try:
+        import fcntl
+    except ImportError:
+        return fh
+    try:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        fh.close()
+        return None
+    return fh
+
+# —— 多进程共享行快照：合并后的行缓存发布为只读列存文件，各 worker 用 mmap 零拷贝映射 ——
+# 布局：魔数 | JSON 头长度(u64) | JSON 头 | 按 8 字节对齐的列数据。
+# 字符串字段 = 偏移列(int64, n+1) + UTF-8 字节块 + 有值标记；来源文件、金额数字格式为去重字符串表 + 下标列
+_SHARED_MAGIC = b"PDFROWS1"
+_SHARED_FORMAT = 1
+_MISSING = object()
+
+def _shared_rows_path() -> str:
+    return os.path.join(_resolve_data_dir(), "rows_shared.bin")
+
+def _publish_shared_rows(view: Dict) -> None:
+    """把行缓存视图写成共享快照文件（临时文件 + 原子替换，正在映射旧文件的进程不受影响）"""
+    rows = view["rows"]
+    n = len(rows)
+    money_fields = sorted(MONEY_FIELDS)
+    str_fields = sorted({k for it in rows for k, v in it.items() if isinstance(v, str) and not k.startswith("__")})
+    str_fields.append("__date_std")
+    columns: Dict[str, Dict] = {}
+    chunks: List[bytes] = []
+    pos = 0
+
+    def put(name: str, data: bytes, typecode: str = "", count: int = 0) -> None:
+        nonlocal pos
+        columns[name] = {"offset": pos, "length": len(data), "type": typecode, "count": count}
+        chunks.append(data)
+        pad = -len(data) % 8
+        if pad:
+            chunks.append(b"\0" * pad)
+        pos += len(data) + pad
+
+    def put_array(name: str, typecode: str, values) -> None:
+        arr = array.array(typecode, values)
+        put(name, arr.tobytes(), typecode, len(arr))
+
+    for f in str_fields:
+        offsets = array.array("q", [0])
+        has = array.array("B")
+        blob = bytearray()
+        for it in rows:
+            v = it.get(f, _MISSING)
+            has.append(0 if v is _MISSING else 1)
+            if v is not _MISSING:
+                blob += str(v).encode("utf-8")
+            offsets.append(len(blob))
+        put(f"s:{f}", bytes(blob))
+        put(f"s:{f}:off", offsets.tobytes(), "q", len(offsets))
+        put(f"s:{f}:has", has.tobytes(), "B", n)
+
+    sources: Dict[str, int] = {}
+    formats: Dict[str, int] = {}
+    decimals: Dict[str, str] = {}
+    for f in money_fields:
+        cents, has, exact, nf = array.array("q"), array.array("B"), array.array("B"), array.array("i")
+        for rid, it in enumerate(rows):
+            v = it["__cents"].get(f)
+            if isinstance(v, int) and _fits_int64(v):
+                cents.append(v); has.append(1); exact.append(1)
+            else:
+                cents.append(int(v) if v is not None and _fits_int64(v) else 0); has.append(0 if v is None else 1); exact.append(0)
+                if v is not None:
+                    decimals[f"{rid}:{f}"] = str(v)
+            fmt = (it.get("__money_number_formats") or {}).get(f)
+            nf.append(-1 if fmt is None else formats.setdefault(fmt, len(formats)))
+        put(f"cents:{f}", cents.tobytes(), "q", n)
+        put(f"has:{f}", has.tobytes(), "B", n)
+        put(f"exact:{f}", exact.tobytes(), "B", n)
+        put(f"nf:{f}", nf.tobytes(), "i", n)
+    has_nf = [1 if "__money_number_formats" in it else 0 for it in rows]
+    ymd = [it["__ymd"] or (0, 0, 0) for it in rows]
+    put_array("has_nf", "B", has_nf)
+    put_array("has_date", "B", (1 if it["__ymd"] is not None else 0 for it in rows))
+    put_array("year", "i", (t[0] for t in ymd))
+    put_array("ym", "i", (t[0] * 100 + t[1] for t in ymd))
+    put_array("ymd", "i", (t[0] * 10000 + t[1] * 100 + t[2] for t in ymd))
+    put_array("day", "b", (t[2] for t in ymd))
+    put_array("settled", "B", (1 if it["__settled"] else 0 for it in rows))
+    put_array("party", "b", (_PARTY_NAMES.index(_classify_party(str(it.get("序号", "")))) for it in rows))
+    put_array("row_index", "q", (int(it.get("__row_index", 0) or 0) for it in rows))
+    put_array("source", "i", (sources.setdefault(it.get("__source_file", ""), len(sources)) for it in rows))
+
+    header = json.dumps({"format": _SHARED_FORMAT, "rows_version": _ROWS_SNAPSHOT_VERSION,
+                         "sig": view["sig"], "built_at": view["built_at"], "n": n,
+                         "money_fields": money_fields, "str_fields": str_fields, "sources": list(sources),
+                         "formats": list(formats), "decimals": decimals, "columns": columns,
+                         "entries": view["entries"]},
+                        ensure_ascii=False).encode("utf-8")
+    path = _shared_rows_path()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_SHARED_MAGIC + struct.pack("<Q", len(header)) + header)
+            f.write(b"\0" * (-(16 + len(header)) % 8))
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+class _SharedRows:
+    """映射共享快照得到的只读行序列：rows[i] 返回按需解码的轻量行对象，列数据留在页缓存里由各进程共享"""
+
+    def __init__(self, mm: mmap.mmap, header: Dict, base: int):
+        self.sig = header["sig"]
+        self.built_at = header["built_at"]
+        self.entries = header.get("entries") or []
+        self._mm = mm
+        self._n = header["n"]
+        self._money_fields = header["money_fields"]
+        self._str_fields = set(header["str_fields"])
+        self._sources = header["sources"]
+        self._formats = header["formats"]
+        self._decimals = header["decimals"]
+        buf = memoryview(mm)
+        self._cols = {}
+        for name, c in header["columns"].items():
+            view = buf[base + c["offset"]: base + c["offset"] + c["length"]]
+            self._cols[name] = view.cast(c["type"]) if c["type"] else view
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, rid: int) -> "_SharedRow":
+        rid = int(rid)
+        if rid < 0:
+            rid += self._n
+        if not 0 <= rid < self._n:
+            raise IndexError(rid)
+        return _SharedRow(self, rid)
+
+    def __iter__(self):
+        for rid in range(self._n):
+            yield _SharedRow(self, rid)
+
+    def _str(self, field: str, rid: int):
+        cols = self._cols
+        if not cols[f"s:{field}:has"][rid]:
+            return _MISSING
+        off = cols[f"s:{field}:off"]
+        return str(cols[f"s:{field}"][off[rid]:off[rid + 1]], "utf-8")
+
+    def _cents(self, field: str, rid: int):
+        cols = self._cols
+        if not cols[f"has:{field}"][rid]:
+            return None
+        if cols[f"exact:{field}"][rid]:
+            return cols[f"cents:{field}"][rid]
+        return decimal.Decimal(self._decimals[f"{rid}:{field}"])
+
+    def field(self, rid: int, key: str):
+        cols = self._cols
+        if key in self._str_fields:
+            return self._str(key, rid)
+        if key == "__cents":
+            return {f: self._cents(f, rid) for f in self._money_fields}
+        if key == "__ymd":
+            if not cols["has_date"][rid]:
+                return None
+            return (cols["year"][rid], cols["ym"][rid] % 100, cols["day"][rid])
+        if key == "__settled":
+            return bool(cols["settled"][rid])
+        if key == "__source_file":
+            return self._sources[cols["source"][rid]]
+        if key == "__row_index":
+            return cols["row_index"][rid]
+        if key == "__money_number_formats":
+            if not cols["has_nf"][rid]:
+                return _MISSING
+            return {f: self._formats[cols[f"nf:{f}"][rid]] for f in self._money_fields if cols[f"nf:{f}"][rid] >= 0}
+        return _MISSING
+
+    def keys(self, rid: int) -> List[str]:
+        keys = [k for k in self._str_fields if self._cols[f"s:{k}:has"][rid]]
+        keys += ["__source_file", "__row_index", "__cents", "__ymd", "__settled"]
+        if self._cols["has_nf"][rid]:
+            keys.append("__money_number_formats")
+        return keys
+
+    def numpy_columns(self) -> Dict:
+        """与 _build_numpy_columns 相同结构的列，直接指向映射内存（不复制）"""
+        import numpy as np
+        cols = self._cols
+        n = self._n
+        out = {"n": n, "cents": {}, "has": {}, "exact": {}}
+        for f in self._money_fields:
+            out["cents"][f] = np.frombuffer(cols[f"cents:{f}"], dtype=np.int64)
+            out["has"][f] = np.frombuffer(cols[f"has:{f}"], dtype=bool)
+            out["exact"][f] = np.frombuffer(cols[f"exact:{f}"], dtype=bool)
+        out["has_date"] = np.frombuffer(cols["has_date"], dtype=bool)
+        out["year"] = np.frombuffer(cols["year"], dtype=np.int32)
+        out["ym"] = np.frombuffer(cols["ym"], dtype=np.int32)
+        out["ymd"] = np.frombuffer(cols["ymd"], dtype=np.int32)
+        out["day"] = np.frombuffer(cols["day"], dtype=np.int8)
+        out["settled"] = np.frombuffer(cols["settled"], dtype=bool)
+        out["party"] = np.frombuffer(cols["party"], dtype=np.int8)
+        out["row_ids"] = np.arange(n, dtype=np.int64)
+        return out
+
+
+class _SharedRow:
+    """共享快照中的一行：只读，支持 get / [] / in，字段在访问时从映射内存解码"""
+    __slots__ = ("_rows", "_rid")
+
+    def __init__(self, rows: _SharedRows, rid: int):
+        self._rows = rows
+        self._rid = rid
+
+    def get(self, key: str, default=None):
+        v = self._rows.field(self._rid, key)
+        return default if v is _MISSING else v
+
+    def __getitem__(self, key: str):
+        v = self._rows.field(self._rid, key)
+        if v is _MISSING:
+            raise KeyError(key)
+        return v
+
+    def __contains__(self, key: str) -> bool:
+        return self._rows.field(self._rid, key) is not _MISSING
+
+    def keys(self) -> List[str]:
+        return self._rows.keys(self._rid)
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+
+def _map_shared_rows(expect_sig: Optional[str] = None) -> Optional["_SharedRows"]:
+    """映射共享快照；文件不存在、格式不符或签名与 expect_sig 不一致时返回 None"""
+    try:
+        with open(_shared_rows_path(), "rb") as f:
+            head = f.read(16)
+            if len(head) != 16 or head[:8] != _SHARED_MAGIC:
+                return None
+            hlen = struct.unpack("<Q", head[8:])[0]
+            header = json.loads(f.read(hlen).decode("utf-8"))
+            if header.get("format") != _SHARED_FORMAT or header.get("rows_version") != _ROWS_SNAPSHOT_VERSION:
+                return None
+            if expect_sig is not None and header.get("sig") != expect_sig:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    return _SharedRows(mm, header, 16 + hlen + (-(16 + hlen) % 8))
+
+# /api/mdirs/reload 只会落到某一个 worker：配置写入 index_config.json，其余进程（含独立索引进程）按 mtime 跟进（至多每 2 秒检查一次）
+_RUNTIME_CONFIG_LOCK = threading.Lock()
+_RUNTIME_CONFIG_STATE = {"mtime_ns": None, "checked": 0.0}
+_RUNTIME_CONFIG_LOCAL = ("shared_snapshot", "indexer")    # 进程级部署参数，不跨进程同步
+
+def _config_shared() -> bool:
+    return bool(CONFIG.get("shared_snapshot")) or CONFIG.get("indexer") == "external"
+
+def _runtime_config_path() -> str:
+    return os.path.join(_resolve_data_dir(), "index_config.json")
+
+# index_config.json 只保存经 /api/mdirs/reload 显式设置过的键 {"version": 2, "overrides": {...}}，
+# 各进程把它们叠加在代码默认值上；旧版本整份 CONFIG 的文件忽略
+_RUNTIME_CONFIG_VERSION = 2
+
+def _load_runtime_overrides() -> Dict:
+    with open(_runtime_config_path(), "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    if not isinstance(payload, dict) or payload.get("version") != _RUNTIME_CONFIG_VERSION:
+        return {}
+    overrides = payload.get("overrides")
+    return overrides if isinstance(overrides, dict) else {}
+
+def _save_runtime_config(updates: Dict) -> Optional[str]:
+    """把本次 reload 设置的键合并进共享覆盖项；失败时记日志并返回错误信息（其他 worker 不会跟进）"""
+    path = _runtime_config_path()
+    updates = {k: v for k, v in updates.items() if k in CONFIG and k not in _RUNTIME_CONFIG_LOCAL}
+    lock = None
+    try:
+        lock = _process_lock("index_config.lock")
+        try:
+            overrides = _load_runtime_overrides()
+        except FileNotFoundError:
+            overrides = {}
+        overrides.update(updates)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": _RUNTIME_CONFIG_VERSION, "overrides": overrides}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        with _RUNTIME_CONFIG_LOCK:
+            _RUNTIME_CONFIG_STATE["mtime_ns"] = os.stat(path).st_mtime_ns
+        return None
+    except (OSError, ValueError) as exc:
+        error = f"写入 {path} 失败: {exc!r}"
+        _auto_update_log(f"配置同步: {error}")
+        return error
+    finally:
+        if lock is not None:
+            lock.close()
+
+def _sync_runtime_config() -> None:
+    if not _config_shared():
+        return
+    now = time.time()
+    with _RUNTIME_CONFIG_LOCK:
+        if now - _RUNTIME_CONFIG_STATE["checked"] < 2:
+            return
+        _RUNTIME_CONFIG_STATE["checked"] = now
+        try:
+            path = _runtime_config_path()
+            mtime_ns = os.stat(path).st_mtime_ns
+            if mtime_ns == _RUNTIME_CONFIG_STATE["mtime_ns"]:
+                return
+            overrides = _load_runtime_overrides()
+        except (OSError, ValueError):
+            return
+        _RUNTIME_CONFIG_STATE["mtime_ns"] = mtime_ns
+    with CONFIG_LOCK:
+        changed = False
+        for k, v in overrides.items():
+            if k in CONFIG and k not in _RUNTIME_CONFIG_LOCAL and CONFIG[k] != v:
+                CONFIG[k] = v
+                changed = True
+    if changed:
+        _watch_mark_dirty(CONFIG.get("roots", []))
+
+def _rows_plan() -> Optional[Dict]:
+    """判断行缓存是否过期：未过期返回 None；过期返回重建计划（已采集的文件清单与签名）。
+    监听器在线且无事件时不访问文件系统；有事件只重新采集脏 root"""
+    _sync_runtime_config()
+    if CONFIG.get("indexer") == "external":
+        return _rows_plan_external()
+    watch = _watch_snapshot()
     with _ROWS_LOCK:
-        _ROWS_CACHE["sig"]  = sig
-        _ROWS_CACHE["rows"] = list(rows)
-    return rows
+        view = _ROWS_CACHE.get("view")
+        dirty_gen = _ROWS_CACHE.get("dirty_gen", 0)
+        clean = (view is not None and _ROWS_CACHE.get("clean_gen", 0) == dirty_gen
+                 and (view.get("retry_at") is None or time.time() < view["retry_at"]))
+        if clean and watch is not None and _ROWS_CACHE.get("watch_version") == watch["version"]:
+            return None
+        mem_parts = dict(_ROWS_CACHE.get("parts", {}))
+        root_results = None
+        if watch is not None:
+            seen = _ROWS_CACHE.get("watch_version")
+            root_results = {} if seen is None else {
+                r: v for r, v in _ROWS_CACHE.get("roots", {}).items() if watch["dirty"].get(r, 0) <= seen
+            }
+
+    files, sig, file_sigs = _gather_excel_files(root_results)
+    with _ROWS_LOCK:
+        if clean and _ROWS_CACHE.get("view") is view and view["scan_sig"] == sig:
+            _ROWS_CACHE["roots"] = root_results or {}
+            _ROWS_CACHE["watch_version"] = watch["version"] if watch is not None else None
+            return None
+    return {"files": files, "sig": sig, "file_sigs": file_sigs, "root_results": root_results,
+            "watch": watch, "mem_parts": mem_parts, "dirty_gen": dirty_gen}
+
+def _published_key():
+    try:
+        st = os.stat(_shared_rows_path())
+    except OSError:
+        return None
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+def _rows_plan_external() -> Optional[Dict]:
+    """独立索引进程模式：只比较已发布快照文件是否换过，不扫描 roots；尚未发布时继续提供现有视图"""
+    key = _published_key()
+    with _ROWS_LOCK:
+        view = _ROWS_CACHE.get("view")
+        if view is not None and (key is None or view.get("published") == key):
+            return None
+        dirty_gen = _ROWS_CACHE.get("dirty_gen", 0)
+    return {"external": True, "published": key, "sig": None, "files": [], "file_sigs": {}, "root_results": None,
+            "watch": None, "mem_parts": {}, "dirty_gen": dirty_gen}
+
+def _rows_build(plan: Dict) -> Dict:
+    """按计划重建并替换为新的不可变视图。shared_snapshot 开启时先尝试映射其他 worker 已发布的同签名快照；
+    否则持 rows_build.lock 由一个进程解析并发布，其余进程等锁后直接映射"""
+    if plan.get("external"):
+        shared = _map_shared_rows()
+        if shared is None:
+            raise HTTPException(503, "索引进程尚未发布行快照")
+        plan["sig"] = shared.sig
+        return _rows_swap(plan, shared, {})
+    if not CONFIG.get("shared_snapshot"):
+        return _rows_build_local(plan)
+    view = _rows_adopt_shared(plan)
+    if view is not None:
+        return view
+    lock = _process_lock("rows_build.lock")
+    try:
+        view = _rows_adopt_shared(plan)
+        if view is not None:
+            return view
+        view = _rows_build_local(plan)
+        _publish_shared_rows(view)
+        return view
+    finally:
+        if lock is not None:
+            lock.close()
+
+def _rows_adopt_shared(plan: Dict) -> Optional[Dict]:
+    shared = _map_shared_rows(plan["sig"])
+    if shared is None:
+        return None
+    return _rows_swap(plan, shared, {})
+
+def _rows_build_local(plan: Dict) -> Dict:
+    """只重解析签名变化的工作簿，合并后整体替换为新的不可变视图"""
+    files, file_sigs, mem_parts = plan["files"], plan["file_sigs"], plan["mem_parts"]
+    # 优先用内存分区，其次磁盘快照，最后才解析
+    snapshot = None
+    parts = {}
+    todo = []
+    for x in files:
+        cached = mem_parts.get(x)
+        if not (cached and cached.get("sig") == file_sigs.get(x)):
+            if snapshot is None:
+                # 冷启动才读磁盘快照；内存分区存在时签名不符即说明文件确已变化
+                snapshot = _load_rows_snapshot() if not mem_parts else {}
+            cached = snapshot.get(x)
+        if cached and cached.get("sig") == file_sigs.get(x):
+            parts[x] = cached
+            continue
+        todo.append(x)
+    failed = []
+    if todo:
+        parsed = _parse_excel_files(todo)
+        for x in todo:
+            error = parsed[x].get("error")
+            if error:
+                # 读取失败的分区不记签名：不落盘，下次重建（parse_retry_interval 后）重新解析
+                failed.append(x)
+                _auto_update_log(f"工作簿读取失败，{CONFIG.get('parse_retry_interval', 30)}s 后重试: {x} ({error})")
+            parts[x] = {"sig": None if error else file_sigs.get(x), "rows": parsed[x]["rows"], "detail": parsed[x]["detail"]}
+    if todo or set(mem_parts) != set(parts):
+        _save_rows_snapshot({x: p for x, p in parts.items() if p.get("sig") is not None})
+
+    # 按 files（即 CONFIG["roots"]）顺序合并，去重优先级与串行解析一致
+    return _rows_swap(plan, _merge_rows([parts[x]["rows"] for x in files]), parts, failed)
+
+# /api/entries/count 的标准表头：表头（去掉末尾空列）与之完全一致的年份计入 total_strict
+_STD_INDEX_HEADER = ["序号","工程地点及内容","单位名称","签订途径","启动时间","结果确定时间","签订日期","控制价","合同额","结算值","已付款","欠付款","备注"]
+
+def _entries_from_parts(files: List[str], parts: Dict) -> List[Dict]:
+    """按年份目录汇总各 index.xlsx 的数据行数（首列非空）与是否标准表头，随行缓存一起建好"""
+    per = []
+    for x in files:
+        year = os.path.basename(os.path.dirname(x))
+        if not year.isdigit():
+            continue
+        detail = (parts.get(x) or {}).get("detail")
+        if not detail or "entries" not in detail:
+            per.append({"year": int(year), "error": "无法读取", "file": x})
+            continue
+        hdr = list(detail["headers"])
+        while hdr and hdr[-1] == "":
+            hdr.pop()
+        per.append({"year": int(year), "rows": detail["entries"], "strict": hdr == _STD_INDEX_HEADER, "file": x})
+    per.sort(key=lambda e: e["year"])
+    return per
+
+def _rows_swap(plan: Dict, rows, parts: Dict, failed: List[str] = ()) -> Dict:
+    """替换为新视图。有工作簿读取失败时视图签名另算（重试成功后数据版本、ETag、查询缓存随之更新），
+    并记录 retry_at 供 _rows_plan 到期重建"""
+    watch = plan["watch"]
+    entries = rows.entries if isinstance(rows, _SharedRows) else _entries_from_parts(plan["files"], parts)
+    sig, retry_at = plan["sig"], None
+    if failed:
+        sig = hashlib.sha1(json.dumps([sig, sorted(failed)], ensure_ascii=False).encode("utf-8")).hexdigest()
+        retry_at = time.time() + float(CONFIG.get("parse_retry_interval", 30) or 0)
+    with _ROWS_LOCK:
+        version = _ROWS_CACHE.get("version", 0) + 1
+        view = {"sig": sig, "scan_sig": plan["sig"], "retry_at": retry_at, "rows": rows, "derived": {},
+                "version": version, "built_at": time.time(), "published": plan.get("published"), "entries": entries}
+        _ROWS_CACHE["version"] = version
+        _ROWS_CACHE["view"] = view
+        _ROWS_CACHE["parts"] = parts
+        _ROWS_CACHE["roots"] = plan["root_results"] or {}
+        _ROWS_CACHE["watch_version"] = watch["version"] if watch is not None else None
+        _ROWS_CACHE["clean_gen"] = plan["dirty_gen"]
+        _ROWS_CACHE["stale_since"] = None
+        return view
+
+# —— 单飞重建：同一时刻只有一个线程解析工作簿，其余调用方等待并复用这次结果 ——
+_ROWS_BUILD_COND = threading.Condition()
+_ROWS_BUILD = {"running": False, "builds": 0, "failures": 0, "waiters": 0, "waits_total": 0, "max_waiters": 0,
+               "last_build_seconds": None, "total_build_seconds": 0.0, "last_error": ""}
+
+def _rows_build_single_flight(plan: Optional[Dict], wait: bool = True) -> Optional[Dict]:
+    """已有重建在进行：wait=True 时等待其完成并返回新视图，否则立即返回 None；
+    没有重建在进行：由当前线程执行（plan 为空时先重新判定是否过期）"""
+    while True:
+        with _ROWS_BUILD_COND:
+            if _ROWS_BUILD["running"]:
+                if not wait:
+                    return None
+                _ROWS_BUILD["waiters"] += 1
+                _ROWS_BUILD["waits_total"] += 1
+                _ROWS_BUILD["max_waiters"] = max(_ROWS_BUILD["max_waiters"], _ROWS_BUILD["waiters"])
+                try:
+                    _ROWS_BUILD_COND.wait_for(lambda: not _ROWS_BUILD["running"])
+                finally:
+                    _ROWS_BUILD["waiters"] -= 1
+                with _ROWS_LOCK:
+                    view = _ROWS_CACHE.get("view")
+                if view is not None:
+                    return view
+                continue    # 上一次重建失败且仍无可用视图：由当前线程接手
+            _ROWS_BUILD["running"] = True
+        break
+
+    started = time.time()
+    try:
+        p = plan if plan is not None else _rows_plan()
+        if p is None:
+            with _ROWS_LOCK:
+                return _ROWS_CACHE.get("view")
+        view = _rows_build(p)
+        with _ROWS_BUILD_COND:
+            elapsed = time.time() - started
+            _ROWS_BUILD["builds"] += 1
+            _ROWS_BUILD["last_build_seconds"] = round(elapsed, 3)
+            _ROWS_BUILD["total_build_seconds"] += elapsed
+        return view
+    except Exception as exc:
+        with _ROWS_BUILD_COND:
+            _ROWS_BUILD["failures"] += 1
+            _ROWS_BUILD["last_error"] = repr(exc)
+        raise
+    finally:
+        with _ROWS_BUILD_COND:
+            _ROWS_BUILD["running"] = False
+            _ROWS_BUILD_COND.notify_all()
+
+def _rows_build_stats() -> Dict:
+    with _ROWS_BUILD_COND:
+        stats = dict(_ROWS_BUILD)
+    stats["total_build_seconds"] = round(stats["total_build_seconds"], 3)
+    return stats
+
+def _refresh_rows_background(plan: Optional[Dict] = None) -> None:
+    """双缓冲：过期时继续提供旧视图，由后台线程单飞重建后原子替换"""
+    with _ROWS_BUILD_COND:
+        if _ROWS_BUILD["running"]:
+            return
+
+    def run():
+        try:
+            _rows_build_single_flight(plan, wait=False)
+        except Exception:
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+def _load_rows_view() -> Dict:
+    """返回当前行缓存视图 {"sig", "rows", "derived", "version", "built_at"}；视图不可变，rows 可直接只读使用。
+    数据过期时立即返回旧视图并触发后台重建；仅在从未建立过缓存、或过期超过 max_staleness 秒时才等待重建"""
+    with _ROWS_LOCK:
+        view = _ROWS_CACHE.get("view")
+    if view is None:
+        return _rows_build_single_flight(None)
+    plan = _rows_plan()
+    if plan is None:
+        with _ROWS_LOCK:
+            return _ROWS_CACHE["view"]
+
+    with _ROWS_LOCK:
+        if not _ROWS_CACHE.get("stale_since"):
+            _ROWS_CACHE["stale_since"] = time.time()
+        stale_since = _ROWS_CACHE["stale_since"]
+    max_staleness = float(CONFIG.get("max_staleness") or 0)
+    if max_staleness > 0 and time.time() - stale_since >= max_staleness:
+        return _rows_build_single_flight(plan)
+    _refresh_rows_background(plan)
+    with _ROWS_LOCK:
+        return _ROWS_CACHE["view"]
+
+def _rows_stale() -> bool:
+    with _ROWS_LOCK:
+        return bool(_ROWS_CACHE.get("stale_since"))
+
+_DERIVED_LOCK = threading.Lock()
+
+def _rows_derived(view: Dict, key: str, builder):
+    """按行缓存版本惰性构建派生结构（列存、索引等）；行缓存重建后自动失效"""
+    derived = view["derived"]
+    if key in derived:
+        return derived[key]
+    with _DERIVED_LOCK:
+        if key not in derived:
+            derived[key] = builder(view["rows"])
+        return derived[key]
+
+def _invalidate_rows_partition(source_file: str) -> None:
+    """丢弃单个工作簿的分区（例如写入备注后）并标记过期，下次重建只重解析该文件"""
+    real = os.path.realpath(source_file)
+    with _ROWS_LOCK:
+        parts = _ROWS_CACHE.get("parts", {})
+        for key in [k for k in parts if k == source_file or os.path.realpath(k) == real]:
+            parts.pop(key, None)
+        _ROWS_CACHE["dirty_gen"] = _ROWS_CACHE.get("dirty_gen", 0) + 1
+        _ROWS_CACHE["watch_version"] = None
+
+# —— 文件变化监听：inotify（Linux）+ 节流轮询兜底 ——
+# 搜索热路径只读 version；dirty 记录 {root: 最近一次变化时的 version}，加载时只重新采集这些 root
+_WATCH_LOCK = threading.Lock()
+_WATCH_STATE = {"active": False, "started": False, "mode": "off", "version": 0, "dirty": {}, "cfg_key": None,
+                "events": 0, "polls": 0}
+
+_IN_MODIFY, _IN_ATTRIB, _IN_CLOSE_WRITE = 0x002, 0x004, 0x008
+_IN_MOVED_FROM, _IN_MOVED_TO, _IN_CREATE, _IN_DELETE = 0x040, 0x080, 0x100, 0x200
+_IN_DELETE_SELF, _IN_MOVE_SELF, _IN_IGNORED, _IN_ISDIR = 0x400, 0x800, 0x8000, 0x40000000
+_IN_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+                  | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+
+def _inotify_open() -> Optional[Dict]:
+    """通过 libc 打开 inotify；非 Linux 或不可用时返回 None（走轮询）"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        return {"libc": libc, "fd": fd, "wds": {}, "paths": {}}
+    except Exception:
+        return None
+
+def _inotify_add(ino: Dict, path: str, root: str) -> None:
+    if path in ino["paths"]:
+        return
+    wd = ino["libc"].inotify_add_watch(ino["fd"], os.fsencode(path), _IN_WATCH_MASK)
+    if wd >= 0:
+        ino["wds"][wd] = (path, root)
+        ino["paths"][path] = wd
+
+def _inotify_clear(ino: Dict) -> None:
+    """移除全部监听（内核随后会为每个 wd 投递 IN_IGNORED，读取时按未知 wd 忽略）"""
+    for wd in list(ino["wds"]):
+        ino["libc"].inotify_rm_watch(ino["fd"], wd)
+    ino["wds"].clear()
+    ino["paths"].clear()
+
+def _inotify_read(ino: Dict) -> List[tuple]:
+    """读出当前所有事件：[(wd, mask, name)]"""
+    events = []
+    try:
+        buf = os.read(ino["fd"], 64 * 1024)
+    except BlockingIOError:
+        return events
+    pos = 0
+    while pos + 16 <= len(buf):
+        wd, mask, _cookie, length = struct.unpack_from("iIII", buf, pos)
+        name = buf[pos + 16:pos + 16 + length].rstrip(b"\0").decode("utf-8", "replace")
+        events.append((wd, mask, name))
+        pos += 16 + length
+    return events
+
+def _watch_cfg_key():
+    return json.dumps([CONFIG.get(k) for k in ("roots", "pdf_subdirs", "excel_patterns", "allowed_exts",
+                                                "public_base", "preview_prefix", "download_prefix")], ensure_ascii=False)
+
+def _watch_mark_dirty(roots) -> None:
+    with _WATCH_LOCK:
+        _WATCH_STATE["version"] += 1
+        for r in roots:
+            _WATCH_STATE["dirty"][r] = _WATCH_STATE["version"]
+
+def _watch_snapshot() -> Optional[Dict]:
+    """监听器在线时返回 {"version", "dirty"}；否则 None（调用方回退到全量签名扫描）"""
+    _ensure_watcher()
+    with _WATCH_LOCK:
+        if not _WATCH_STATE["active"]:
+            return None
+        return {"version": _WATCH_STATE["version"], "dirty": dict(_WATCH_STATE["dirty"])}
+
+def _inotify_register(ino: Dict, roots: List[str]) -> None:
+    """监听各 root、其 PDF 子目录以及 root 的父目录（用于发现新建的年份目录）"""
+    subdirs = CONFIG.get("pdf_subdirs", []) or []
+    for root in roots:
+        parent = os.path.dirname(root.rstrip("/")) or "/"
+        if os.path.isdir(parent):
+            _inotify_add(ino, parent, "")
+        for d in [root] + [os.path.join(root, sd) for sd in subdirs]:
+            if os.path.isdir(d):
+                _inotify_add(ino, d, root)
+
+def _watch_loop() -> None:
+    ino = _inotify_open()
+    with _WATCH_LOCK:
+        _WATCH_STATE["mode"] = "inotify" if ino else "poll"
+    baseline: Dict[str, Optional[Dict]] = {}
+    last_poll = 0.0
+    while True:
+        try:
+            if not CONFIG.get("watch_enabled", True):
+                time.sleep(5)
+                continue
+            roots = list(CONFIG.get("roots", []))
+            cfg_key = _watch_cfg_key()
+            if cfg_key != _WATCH_STATE["cfg_key"]:
+                # 配置变化（/api/mdirs/reload）：重建监听集合并视所有 root 为脏
+                if ino:
+                    _inotify_clear(ino)
+                    _inotify_register(ino, roots)
+                baseline = {r: _gather_root(r) for r in roots}
+                last_poll = time.time()
+                with _WATCH_LOCK:
+                    _WATCH_STATE["cfg_key"] = cfg_key
+                _watch_mark_dirty(roots)
+                with _WATCH_LOCK:
+                    _WATCH_STATE["active"] = True
+
+            interval = float(CONFIG.get("watch_rescan_interval" if ino else "watch_poll_interval", 60 if ino else 5) or 0)
+            timeout = max(0.5, min(interval, 5.0)) if interval > 0 else 5.0
+            if ino:
+                ready, _, _ = select.select([ino["fd"]], [], [], timeout)
+                if ready:
+                    dirty = set()
+                    rewatch = False
+                    for wd, mask, name in _inotify_read(ino):
+                        if wd not in ino["wds"]:
+                            continue
+                        path, root = ino["wds"][wd]
+                        if mask & _IN_IGNORED:
+                            ino["wds"].pop(wd, None)
+                            if ino["paths"].get(path) == wd:
+                                ino["paths"].pop(path, None)
+                            rewatch = True
+                            continue
+                        if not root:
+                            # 父目录事件：只关心与某个 root 同名的子目录
+                            full = os.path.join(path, name)
+                            dirty.update(r for r in roots if r.rstrip("/") == full)
+                            rewatch = True
+                            continue
+                        dirty.add(root)
+                        if mask & _IN_ISDIR:
+                            rewatch = True
+                    if rewatch:
+                        _inotify_register(ino, roots)
+                    if dirty:
+                        with _WATCH_LOCK:
+                            _WATCH_STATE["events"] += 1
+                        _watch_mark_dirty(dirty)
+            else:
+                time.sleep(timeout)
+
+            # 节流轮询：无 inotify 时是主机制；有 inotify 时兜底 NFS 等收不到事件的变化
+            if interval > 0 and time.time() - last_poll >= interval:
+                last_poll = time.time()
+                changed = []
+                for r in roots:
+                    cur = _gather_root(r)
+                    if cur != baseline.get(r):
+                        changed.append(r)
+                    baseline[r] = cur
+                with _WATCH_LOCK:
+                    _WATCH_STATE["polls"] += 1
+                if changed:
+                    if ino:
+                        _inotify_register(ino, roots)
+                    _watch_mark_dirty(changed)
+        except Exception:
+            # 监听异常时退回全量签名扫描，稍后重试
+            with _WATCH_LOCK:
+                _WATCH_STATE["active"] = False
+                _WATCH_STATE["cfg_key"] = None
+            time.sleep(5)
+
+def _ensure_watcher() -> None:
+    if not CONFIG.get("watch_enabled", True):
+        with _WATCH_LOCK:
+            _WATCH_STATE["active"] = False
+            _WATCH_STATE["cfg_key"] = None
+        return
+    with _WATCH_LOCK:
+        if _WATCH_STATE["started"]:
+            return
+        _WATCH_STATE["started"] = True
+    threading.Thread(target=_watch_loop, daemon=True).start()
 
 def _pending_snapshot_path() -> str:
     data_dir = _resolve_data_dir()
@@ -613,6 +1765,20 @@ class QueryIn(BaseModel):
     合同额: Optional[str]=""      # 数值等价；"0" 视为忽略
     欠付款为0: Optional[bool]=True
     欠付款不为0: Optional[bool]=True
+    # 金额区间（元，含端点；空=不限；与其他条件 AND，无该金额的行不命中）
+    控制价_min: Optional[str]=""
+    控制价_max: Optional[str]=""
+    合同额_min: Optional[str]=""
+    合同额_max: Optional[str]=""
+    结算值_min: Optional[str]=""
+    结算值_max: Optional[str]=""
+    已付款_min: Optional[str]=""
+    已付款_max: Optional[str]=""
+    欠付款_min: Optional[str]=""
+    欠付款_max: Optional[str]=""
+    # 签订日期区间（含端点；年/年月/年月日均可，缺失部分下限按 0、上限按 99 补齐）
+    签订日期_from: Optional[str]=""
+    签订日期_to: Optional[str]=""
     # 可选覆盖开关（不传则使用全局配置）
     case_insensitive: Optional[bool]=None
     text_logic_or: Optional[bool]=None
@@ -631,6 +1797,22 @@ class ReloadIn(BaseModel):
     amount_numeric_equivalence: Optional[bool] = None
     amount_zero_means_empty: Optional[bool] = None
     text_logic_or: Optional[bool] = None
+    watch_enabled: Optional[bool] = None
+    watch_poll_interval: Optional[float] = None
+    watch_rescan_interval: Optional[float] = None
+    search_engine: Optional[str] = None
+    text_index_enabled: Optional[bool] = None
+    query_cache_entries: Optional[int] = None
+    query_cache_max_ids: Optional[int] = None
+    max_staleness: Optional[float] = None
+    parse_workers: Optional[int] = None
+    xlsx_reader: Optional[str] = None
+    parse_retry_interval: Optional[float] = None
+    shared_snapshot: Optional[bool] = None
+    export_workers: Optional[int] = None
+    export_cache_max_mb: Optional[float] = None
+    export_cache_max_age_hours: Optional[float] = None
+    remark_flush_delay: Optional[float] = None
 
 
 def _parse_amount_decimal(value) -> decimal.Decimal:
@@ -783,7 +1965,48 @@ def _parse_year_filter_expr(expr: str) -> Optional[Dict]:
     }
 
 
-def _collect_search_results(q: QueryIn):
+def _date_kw_parts(kw_date: str):
+    """把 kw_date 编译为 (精度, 年, 月, 日)，精度为 y/ym/ymd；不是这三种标准形态返回 None（按字符串兜底匹配）"""
+    if re.fullmatch(r"\d{4}-?", kw_date):
+        return ("y", int(kw_date[:4]), 0, 0)
+    if re.fullmatch(r"\d{4}-\d{2}", kw_date):
+        return ("ym", int(kw_date[:4]), int(kw_date[5:7]), 0)
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", kw_date):
+        return ("ymd", int(kw_date[:4]), int(kw_date[5:7]), int(kw_date[8:10]))
+    return None
+
+
+def _date_parts_match(kw_parts, ymd) -> bool:
+    """与 _date_match 相同的前缀语义，但只比较整数"""
+    if ymd is None:
+        return False
+    kind, y, m, d = kw_parts
+    if kind == "y":
+        return ymd[0] == y
+    if kind == "ym":
+        return ymd[0] == y and ymd[1] == m
+    return ymd[2] != 0 and ymd == (y, m, d)
+
+
+def _classify_party(index_no: str) -> str:
+    t = (index_no or "").upper()
+    if "GF" in t:
+        return "国丰"
+    if "HT" in t:
+        return "华腾"
+    if "DQ" in t:
+        return "蝶泉"
+    return "其他"
+
+
+_PARTY_NAMES = ["国丰", "华腾", "蝶泉", "其他"]
+
+
+_AMOUNT_RANGE_FIELDS = ["控制价", "合同额", "结算值", "已付款", "欠付款"]
+
+
+def _prepare_search(q: QueryIn) -> Dict:
+    """把 QueryIn 解析成与引擎无关的检索条件"""
     # 读取配置/覆盖
     ci = q.case_insensitive if q.case_insensitive is not None else CONFIG.get("case_insensitive", True)
     text_or = q.text_logic_or if q.text_logic_or is not None else CONFIG.get("text_logic_or", False)
@@ -793,9 +2016,6 @@ def _collect_search_results(q: QueryIn):
         s = str(s or "")
         return s.lower() if ci else s
 
-    data = _load_all_rows()
-    res = []
-
     kw_loc = norm_text((q.工程地点及内容 or "").strip())
     kw_unit = norm_text((q.单位名称 or "").strip())
     kw_no_raw = norm_text((q.合同编号 or "").strip())
@@ -809,8 +2029,18 @@ def _collect_search_results(q: QueryIn):
             kw_date = kw_date + "-"   # 年/年月/年月日 → 前缀匹配
     kw_amt = _normalize_amount_to_decimal((q.合同额 or "").strip()) if amt_numeric else None
 
-    include_unpaid_zero = q.欠付款为0 if q.欠付款为0 is not None else True
-    include_unpaid_non_zero = q.欠付款不为0 if q.欠付款不为0 is not None else True
+    # 金额区间：[(字段, 下限分值或 None, 上限分值或 None)]；0 是有效端点，无法识别的端点忽略
+    amount_ranges = []
+    for f in _AMOUNT_RANGE_FIELDS:
+        lo = _amount_to_cents(getattr(q, f"{f}_min", "") or "")
+        hi = _amount_to_cents(getattr(q, f"{f}_max", "") or "")
+        if lo is not None or hi is not None:
+            amount_ranges.append((f, lo, hi))
+    date_range = None
+    date_lo = _date_range_bound(q.签订日期_from, 0)
+    date_hi = _date_range_bound(q.签订日期_to, 99)
+    if date_lo is not None or date_hi is not None:
+        date_range = (date_lo, date_hi)
 
     # 哪些文本条件参与（空的不参与）
     text_filters = []
@@ -823,58 +2053,458 @@ def _collect_search_results(q: QueryIn):
     if year_filter:
         text_filters.append(("签订年份", year_filter.get("years", set())))
     elif kw_date:
-        text_filters.append(("签订日期_norm_prefix", kw_date))
+        kw_parts = _date_kw_parts(kw_date)
+        if kw_parts is not None:
+            text_filters.append(("签订日期_parts", kw_parts))
+        else:
+            text_filters.append(("签订日期_norm_prefix", kw_date))
 
-    for it in data:
-        ok = True
+    return {
+        "ci": ci,
+        "text_or": text_or,
+        "zero_empty": CONFIG.get("amount_zero_means_empty", True),
+        # 金额数值等价（提供且非0时才参与）
+        "kw_cents": _amount_to_cents(kw_amt) if kw_amt is not None else None,
+        "amount_ranges": amount_ranges,
+        "date_range": date_range,
+        "include_unpaid_zero": q.欠付款为0 if q.欠付款为0 is not None else True,
+        "include_unpaid_non_zero": q.欠付款不为0 if q.欠付款不为0 is not None else True,
+        "text_filters": text_filters,
+        "kw_date": kw_date,
+        "year_filter": year_filter,
+    }
 
-        # 1) 金额数值等价（提供且非0时才参与）
-        if amt_numeric and (kw_amt is not None):
-            item_amt = _normalize_amount_to_decimal(it.get("合同额", ""))
-            if item_amt is None or item_amt != kw_amt:
-                ok = False
-        if not ok:
-            continue
+
+def _row_text_hit(kind: str, val, it: dict, ci: bool) -> bool:
+    """单行单个文本条件是否命中"""
+    if kind in ("工程地点及内容", "单位名称"):
+        hay = str(it.get(kind, "") or "")
+        return val in (hay.lower() if ci else hay)
+    if kind == "合同编号_or_序号":
+        hay = str(it.get("合同编号", "") or it.get("序号", "") or "")
+        hay = hay.lower() if ci else hay
+        return any(term in hay for term in val)
+    if kind == "签订日期_parts":
+        return _date_parts_match(val, it["__ymd"])
+    if kind == "签订日期_norm_prefix":
+        return globals().get('_date_match', _date_match)(val, it["__date_std"])
+    if kind == "签订年份":
+        ymd = it["__ymd"]
+        return ymd[0] in val if ymd is not None else False
+    return False
+
+
+_TEXT_INDEX_FIELDS = ("工程地点及内容", "单位名称")
+
+
+def _build_text_index(rows: List[dict]) -> Dict:
+    """工程地点及内容/单位名称 的字符 bigram 倒排索引（小写文本上建立；单字关键词用 unigram）：
+    {field: {"lows": [小写文本], "postings": {gram: array(行号升序)}}}"""
+    index = {}
+    for field in _TEXT_INDEX_FIELDS:
+        lows = []
+        postings: Dict[str, array.array] = {}
+        for rid, it in enumerate(rows):
+            low = str(it.get(field, "") or "").lower()
+            lows.append(low)
+            grams = set(low)
+            grams.update(low[i:i + 2] for i in range(len(low) - 1))
+            for g in grams:
+                plist = postings.get(g)
+                if plist is None:
+                    plist = postings[g] = array.array("I")
+                plist.append(rid)
+        index[field] = {"lows": lows, "postings": postings}
+    return index
+
+
+def _text_index_hits(view: Dict, field: str, kw: str, ci: bool) -> set:
+    """用倒排表求交得到候选行，再逐个校验子串，结果与 `kw in 文本` 完全一致"""
+    idx = _rows_derived(view, "text_index", _build_text_index)[field]
+    key = kw.lower()
+    grams = {key} if len(key) == 1 else {key[i:i + 2] for i in range(len(key) - 1)}
+    plists = []
+    for g in grams:
+        plist = idx["postings"].get(g)
+        if not plist:
+            return set()
+        plists.append(plist)
+    plists.sort(key=len)
+    cand = set(plists[0])
+    for plist in plists[1:]:
+        cand.intersection_update(plist)
+        if not cand:
+            return cand
+    if ci:
+        lows = idx["lows"]
+        return {rid for rid in cand if kw in lows[rid]}
+    rows = view["rows"]
+    return {rid for rid in cand if kw in str(rows[rid].get(field, "") or "")}
+
+
+def _build_amount_index(rows: List[dict]) -> Dict:
+    """各金额字段按分值升序排列的 (keys, ids)：keys 为分值，ids 为对应行号；无值的行不在其中"""
+    index = {}
+    for f in MONEY_FIELDS:
+        pairs = [(v, rid) for rid, v in enumerate(it["__cents"].get(f) for it in rows) if v is not None]
+        pairs.sort(key=lambda p: p[0])
+        index[f] = {"keys": [v for v, _ in pairs], "ids": array.array("I", (rid for _, rid in pairs))}
+    return index
+
+
+def _amount_range_ids(view: Dict, field: str, lo, hi) -> array.array:
+    """金额在 [lo, hi]（分，None 表示不限）内的行号：两次二分取有序数组的连续片段，行号无序"""
+    idx = _rows_derived(view, "amount_index", _build_amount_index)[field]
+    keys = idx["keys"]
+    start = bisect.bisect_left(keys, lo) if lo is not None else 0
+    stop = bisect.bisect_right(keys, hi) if hi is not None else len(keys)
+    return idx["ids"][start:stop] if start < stop else array.array("I")
+
+
+def _date_range_bound(s: str, fill: int) -> Optional[int]:
+    """签订日期区间端点 → 整数 YYYYMMDD；缺失的月/日用 fill 补齐（下限 0、上限 99）；无法识别返回 None"""
+    kw_parts = _date_kw_parts(_norm_in_date_std((s or "").strip())) if (s or "").strip() else None
+    if kw_parts is None:
+        return None
+    kind, y, m, d = kw_parts
+    if kind == "y":
+        m = d = fill
+    elif kind == "ym":
+        d = fill
+    return y * 10000 + m * 100 + d
+
+
+def _ymd_key(ymd) -> int:
+    """(年, 月, 日) → 整数 YYYYMMDD，缺失部分为 0，与 _date_range_bound 同序"""
+    return ymd[0] * 10000 + ymd[1] * 100 + ymd[2]
+
+
+def _build_date_index(rows: List[dict]) -> Dict:
+    """签订日期按 YYYYMMDD 升序排列的 (keys, ids)；无法识别日期的行不在其中"""
+    pairs = [(_ymd_key(it["__ymd"]), rid) for rid, it in enumerate(rows) if it["__ymd"] is not None]
+    pairs.sort(key=lambda p: p[0])
+    return {"keys": array.array("q", (k for k, _ in pairs)), "ids": array.array("I", (rid for _, rid in pairs))}
+
+
+def _date_range_ids(view: Dict, lo: Optional[int], hi: Optional[int]) -> array.array:
+    """签订日期在 [lo, hi] 内的行号（行号无序）"""
+    idx = _rows_derived(view, "date_index", _build_date_index)
+    keys = idx["keys"]
+    start = bisect.bisect_left(keys, lo) if lo is not None else 0
+    stop = bisect.bisect_right(keys, hi) if hi is not None else len(keys)
+    return idx["ids"][start:stop] if start < stop else array.array("I")
+
+
+def _range_candidates(spec: Dict, view: Dict) -> Optional[set]:
+    """所有金额区间与签订日期区间命中行号的交集；没有区间条件时返回 None"""
+    slices = [_amount_range_ids(view, f, lo, hi) for f, lo, hi in spec["amount_ranges"]]
+    if spec["date_range"] is not None:
+        slices.append(_date_range_ids(view, *spec["date_range"]))
+    cand = None
+    for ids in sorted(slices, key=len):
+        cand = set(ids) if cand is None else cand.intersection(ids)
+        if not cand:
+            break
+    return cand
+
+
+def _indexed_text_hits(spec: Dict, view: Dict) -> Dict[str, set]:
+    """对可走倒排索引的文本条件预先求出命中行集合"""
+    if not CONFIG.get("text_index_enabled", True):
+        return {}
+    return {kind: _text_index_hits(view, kind, val, spec["ci"])
+            for kind, val in spec["text_filters"] if kind in _TEXT_INDEX_FIELDS}
+
+
+def _match_rows_python(spec: Dict, view: Dict) -> List[int]:
+    """逐行过滤，返回命中行号（升序）"""
+    rows = view["rows"]
+    ci = spec["ci"]
+    text_or = spec["text_or"]
+    zero_empty = spec["zero_empty"]
+    kw_cents = spec["kw_cents"]
+    text_filters = spec["text_filters"]
+    include_unpaid_zero = spec["include_unpaid_zero"]
+    include_unpaid_non_zero = spec["include_unpaid_non_zero"]
+
+    pre_hits = _indexed_text_hits(spec, view)
+    candidates = range(len(rows))
+    cand = _range_candidates(spec, view)
+    if pre_hits and not text_or:
+        # AND：只需遍历各索引命中集合的交集
+        for hit_set in pre_hits.values():
+            cand = set(hit_set) if cand is None else cand & hit_set
+    if cand is not None:
+        candidates = sorted(cand)
+
+    ids = []
+    for rid in candidates:
+        it = rows[rid]
+        # 1) 金额数值等价：比较预先算好的分值
+        if kw_cents is not None:
+            item_cents = it["__cents"].get("合同额")
+            if item_cents is None or (zero_empty and item_cents == 0) or item_cents != kw_cents:
+                continue
 
         # 2) 文本条件：AND（默认）；OR 可通过 text_logic_or=true 切换
         if text_filters:
-            hits = []
-            for kind, val in text_filters:
-                if kind == "工程地点及内容":
-                    hits.append(val in norm_text(it.get("工程地点及内容", "")))
-                elif kind == "单位名称":
-                    hits.append(val in norm_text(it.get("单位名称", "")))
-                elif kind == "合同编号_or_序号":
-                    hay = norm_text(it.get("合同编号", "") or it.get("序号", ""))
-                    hits.append(any(term in hay for term in val))
-                elif kind == "签订日期_norm_prefix":
-                    cur = _norm_in_date(it.get("签订日期_norm", "") or it.get("签订日期", ""))
-                    hits.append(globals().get('_date_match', _date_match)(kw_date, cur))
-                elif kind == "签订年份":
-                    cur = _norm_in_date_std(it.get("签订日期_norm", "") or it.get("签订日期", ""))
-                    row_year = int(cur[:4]) if len(cur) >= 4 and cur[:4].isdigit() else None
-                    hits.append(row_year in val if row_year is not None else False)
+            hits = [(rid in pre_hits[kind]) if kind in pre_hits else _row_text_hit(kind, val, it, ci)
+                    for kind, val in text_filters]
             if text_or:
                 if not any(hits):
-                    ok = False
+                    continue
             else:
                 if not all(hits):
-                    ok = False
-
-        if not ok:
-            continue
+                    continue
 
-        is_settled = _is_settled_row(it)
+        is_settled = it["__settled"]
         if (is_settled and not include_unpaid_zero) or ((not is_settled) and not include_unpaid_non_zero):
             continue
+        ids.append(rid)
+    return ids
+
+
+def _fits_int64(v) -> bool:
+    """金额分值能否放进 int64 列；超出范围的按非精确值处理（列中记 0，比较时回到行缓存原值）"""
+    return -2**63 <= v < 2**63
+
+
+def _build_numpy_columns(rows: List[dict]) -> Dict:
+    """把行缓存转成 NumPy 列存：金额分值(int64)+有值/精确标记、年/月/日、结清标记、甲方分类代码"""
+    if isinstance(rows, _SharedRows):
+        return rows.numpy_columns()
+    import numpy as np
+    n = len(rows)
+    cols = {"n": n, "cents": {}, "has": {}, "exact": {}}
+    for f in MONEY_FIELDS:
+        vals = [it["__cents"].get(f) for it in rows]
+        cols["has"][f] = np.fromiter((v is not None for v in vals), dtype=bool, count=n)
+        cols["exact"][f] = np.fromiter((isinstance(v, int) and _fits_int64(v) for v in vals), dtype=bool, count=n)
+        cols["cents"][f] = np.fromiter((int(v) if v is not None and _fits_int64(v) else 0 for v in vals), dtype=np.int64, count=n)
+    ymd = [it["__ymd"] or (0, 0, 0) for it in rows]
+    cols["has_date"] = np.fromiter((it["__ymd"] is not None for it in rows), dtype=bool, count=n)
+    cols["year"] = np.fromiter((t[0] for t in ymd), dtype=np.int32, count=n)
+    cols["ym"] = np.fromiter((t[0] * 100 + t[1] for t in ymd), dtype=np.int32, count=n)
+    cols["ymd"] = np.fromiter((t[0] * 10000 + t[1] * 100 + t[2] for t in ymd), dtype=np.int32, count=n)
+    cols["day"] = np.fromiter((t[2] for t in ymd), dtype=np.int8, count=n)
+    cols["settled"] = np.fromiter((bool(it["__settled"]) for it in rows), dtype=bool, count=n)
+    cols["party"] = np.fromiter((_PARTY_NAMES.index(_classify_party(str(it.get("序号", "")))) for it in rows), dtype=np.int8, count=n)
+    cols["row_ids"] = np.arange(n, dtype=np.int64)
+    return cols
+
+
+def _match_rows_numpy(spec: Dict, view: Dict) -> List[int]:
+    """向量化过滤：金额/日期/结清用布尔掩码，文本子串只对掩码幸存行用 Python 校验"""
+    import numpy as np
+    rows = view["rows"]
+    cols = _rows_derived(view, "numpy_columns", _build_numpy_columns)
+    n = cols["n"]
+    mask = np.ones(n, dtype=bool)
+
+    kw_cents = spec["kw_cents"]
+    if kw_cents is not None:
+        has = cols["has"]["合同额"]
+        if isinstance(kw_cents, int) and _fits_int64(kw_cents):
+            m = has & cols["exact"]["合同额"] & (cols["cents"]["合同额"] == kw_cents)
+            if spec["zero_empty"]:
+                m &= cols["cents"]["合同额"] != 0
+        else:
+            m = np.zeros(n, dtype=bool)
+            for rid in np.flatnonzero(has & ~cols["exact"]["合同额"]):
+                m[rid] = rows[rid]["__cents"].get("合同额") == kw_cents
+        mask &= m
+
+    slices = [_amount_range_ids(view, f, lo, hi) for f, lo, hi in spec["amount_ranges"]]
+    if spec["date_range"] is not None:
+        slices.append(_date_range_ids(view, *spec["date_range"]))
+    for ids in slices:
+        m = np.zeros(n, dtype=bool)
+        m[np.frombuffer(ids, dtype=np.uint32)] = True
+        mask &= m
+
+    if not spec["include_unpaid_zero"]:
+        mask &= ~cols["settled"]
+    if not spec["include_unpaid_non_zero"]:
+        mask &= cols["settled"]
+
+    text_filters = spec["text_filters"]
+    if not text_filters:
+        return cols["row_ids"][mask].tolist()
+
+    vector_masks = []
+    py_filters = []
+    pre_hits = _indexed_text_hits(spec, view)
+    for kind, val in text_filters:
+        if kind in pre_hits:
+            vm = np.zeros(n, dtype=bool)
+            if pre_hits[kind]:
+                vm[np.fromiter(pre_hits[kind], dtype=np.int64)] = True
+            vector_masks.append(vm)
+        elif kind == "签订年份":
+            vector_masks.append(cols["has_date"] & np.isin(cols["year"], np.fromiter(val, dtype=np.int32)))
+        elif kind == "签订日期_parts":
+            k, y, mo, d = val
+            if k == "y":
+                vm = cols["year"] == y
+            elif k == "ym":
+                vm = cols["ym"] == y * 100 + mo
+            else:
+                vm = (cols["day"] != 0) & (cols["ymd"] == y * 10000 + mo * 100 + d)
+            vector_masks.append(cols["has_date"] & vm)
+        else:
+            py_filters.append((kind, val))
+
+    ci = spec["ci"]
+    if spec["text_or"]:
+        hit = np.zeros(n, dtype=bool)
+        for vm in vector_masks:
+            hit |= vm
+        out = mask & hit
+        if py_filters:
+            for rid in np.flatnonzero(mask & ~hit):
+                it = rows[rid]
+                if any(_row_text_hit(kind, val, it, ci) for kind, val in py_filters):
+                    out[rid] = True
+        return cols["row_ids"][out].tolist()
+
+    for vm in vector_masks:
+        mask &= vm
+    if not py_filters:
+        return cols["row_ids"][mask].tolist()
+    ids = []
+    for rid in np.flatnonzero(mask).tolist():
+        it = rows[rid]
+        if all(_row_text_hit(kind, val, it, ci) for kind, val in py_filters):
+            ids.append(rid)
+    return ids
+
+
+def _match_rows(spec: Dict, view: Dict) -> List[int]:
+    if CONFIG.get("search_engine", "python") == "numpy":
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            return _match_rows_numpy(spec, view)
+    return _match_rows_python(spec, view)
+
+
+# —— 查询结果 LRU：缓存完整命中行号列表，键 = 规范化查询条件，随行缓存签名整体失效 ——
+_QUERY_CACHE: "OrderedDict[str, Dict]" = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+_QUERY_CACHE_STATS = {"sig": None, "hits": 0, "misses": 0, "evictions": 0, "ids": 0}
+
+
+def _query_cache_key(spec: Dict) -> str:
+    filters = [[kind, sorted(val) if isinstance(val, (set, list)) else val] for kind, val in spec["text_filters"]]
+    ranges = [[f, str(lo), str(hi)] for f, lo, hi in spec["amount_ranges"]]
+    if spec["date_range"] is not None:
+        ranges.append(["签订日期", *spec["date_range"]])
+    return json.dumps([spec["ci"], spec["text_or"], spec["zero_empty"], str(spec["kw_cents"]),
+                       spec["include_unpaid_zero"], spec["include_unpaid_non_zero"], filters, ranges],
+                      ensure_ascii=False, default=str)
+
+
+def _search_matches(spec: Dict, view: Dict) -> Dict:
+    """命中结果 {"ids": 行号(升序), "count_strict": 有序号的命中数}；相同条件 + 相同数据签名直接命中缓存（翻页、导出、重复搜索）"""
+    key = _query_cache_key(spec)
+    with _QUERY_CACHE_LOCK:
+        if _QUERY_CACHE_STATS["sig"] != view["sig"]:
+            _QUERY_CACHE.clear()
+            _QUERY_CACHE_STATS["sig"] = view["sig"]
+            _QUERY_CACHE_STATS["ids"] = 0
+        hit = _QUERY_CACHE.get(key)
+        if hit is not None:
+            _QUERY_CACHE.move_to_end(key)
+            _QUERY_CACHE_STATS["hits"] += 1
+            return hit
+        _QUERY_CACHE_STATS["misses"] += 1
+
+    rows = view["rows"]
+    ids = array.array("I", _match_rows(spec, view))
+    result = {"ids": ids, "count_strict": sum(1 for rid in ids if rows[rid].get("序号"))}
+
+    max_entries = int(CONFIG.get("query_cache_entries", 256) or 0)
+    max_ids = int(CONFIG.get("query_cache_max_ids", 2000000) or 0)
+    if max_entries <= 0 or len(ids) > max_ids:
+        return result
+    with _QUERY_CACHE_LOCK:
+        if _QUERY_CACHE_STATS["sig"] != view["sig"] or key in _QUERY_CACHE:
+            return result
+        _QUERY_CACHE[key] = result
+        _QUERY_CACHE_STATS["ids"] += len(ids)
+        while len(_QUERY_CACHE) > max_entries or _QUERY_CACHE_STATS["ids"] > max_ids:
+            _, old = _QUERY_CACHE.popitem(last=False)
+            _QUERY_CACHE_STATS["ids"] -= len(old["ids"])
+            _QUERY_CACHE_STATS["evictions"] += 1
+    return result
+
+
+def _query_cache_stats() -> Dict:
+    with _QUERY_CACHE_LOCK:
+        return {"entries": len(_QUERY_CACHE), "ids": _QUERY_CACHE_STATS["ids"], "hits": _QUERY_CACHE_STATS["hits"],
+                "misses": _QUERY_CACHE_STATS["misses"], "evictions": _QUERY_CACHE_STATS["evictions"]}
+
+
+def _build_facet_columns(rows: List[dict]) -> Dict:
+    """分组统计用的紧凑列：甲方分类代码、签订年份(0=无法识别)、结清标记、各金额字段分值"""
+    return {
+        "party": bytes(_PARTY_NAMES.index(_classify_party(str(it.get("序号", "")))) for it in rows),
+        "year": array.array("i", ((it["__ymd"] or (0,))[0] for it in rows)),
+        "settled": bytes(1 if it["__settled"] else 0 for it in rows),
+        "cents": {f: [it["__cents"].get(f) for it in rows] for f in _AMOUNT_RANGE_FIELDS},
+    }
 
-        money_nf = it.get("__money_number_formats", {}) if isinstance(it.get("__money_number_formats", {}), dict) else {}
-        item = {k: _format_cell_for_display(k, it.get(k, ""), money_nf.get(k)) for k in RETURN_FIELDS}
-        item["__source_file"] = it.get("__source_file", "")
-        item["__row_index"] = it.get("__row_index", 0)
-        res.append(item)
 
-    return res, kw_date, year_filter
+def _facet_bucket(groups: Dict, key) -> Dict:
+    bucket = groups.get(key)
+    if bucket is None:
+        bucket = groups[key] = {"count": 0, "sums": {f: 0 for f in _AMOUNT_RANGE_FIELDS}}
+    return bucket
+
+
+def _facet_payload(bucket: Dict) -> Dict:
+    """分值合计 → 元（两位小数字符串，与导出汇总表一致）"""
+    sums = {f: f"{(decimal.Decimal(v) / 100).quantize(decimal.Decimal('0.01'), rounding=decimal.ROUND_HALF_UP):.2f}"
+            for f, v in bucket["sums"].items()}
+    return {"count": bucket["count"], "sums": sums}
+
+
+def _compute_facets(ids, view: Dict) -> Dict:
+    """一次遍历命中行号，同时按 甲方 / 签订年份 / 结清状态 累计条数与各金额合计"""
+    cols = _rows_derived(view, "facet_columns", _build_facet_columns)
+    party_col, year_col, settled_col, cents = cols["party"], cols["year"], cols["settled"], cols["cents"]
+    total = _facet_bucket({}, None)
+    by_party: Dict[int, Dict] = {}
+    by_year: Dict[int, Dict] = {}
+    by_settled: Dict[int, Dict] = {}
+    for rid in ids:
+        buckets = (total, _facet_bucket(by_party, party_col[rid]), _facet_bucket(by_year, year_col[rid]),
+                   _facet_bucket(by_settled, settled_col[rid]))
+        for b in buckets:
+            b["count"] += 1
+        for f in _AMOUNT_RANGE_FIELDS:
+            v = cents[f][rid]
+            if v is not None:
+                for b in buckets:
+                    b["sums"][f] += v
+    return {
+        "total": _facet_payload(total),
+        "party": [dict(_facet_payload(_facet_bucket(by_party, code)), name=name) for code, name in enumerate(_PARTY_NAMES)],
+        "year": [dict(_facet_payload(by_year[y]), year=y or None) for y in sorted(by_year, key=lambda y: (y == 0, y))],
+        "settled": [dict(_facet_payload(by_settled[flag]), settled=bool(flag)) for flag in sorted(by_settled, reverse=True)],
+    }
+
+
+def _format_result_row(it: dict) -> dict:
+    """行缓存条目 → 接口返回的展示字段（只对实际返回/导出的行调用）"""
+    money_nf = it.get("__money_number_formats", {}) if isinstance(it.get("__money_number_formats", {}), dict) else {}
+    item = {k: _format_cell_for_display(k, it.get(k, ""), money_nf.get(k)) for k in RETURN_FIELDS}
+    item["__source_file"] = it.get("__source_file", "")
+    item["__row_index"] = it.get("__row_index", 0)
+    return item
+
 
 class AutoUpdateToggleIn(BaseModel):
     enabled: bool
@@ -900,139 +2530,536 @@ def login(data: dict):
 
 @app.post("/api/mdirs/reload", dependencies=[Depends(require_auth)])
 def reload_cfg(body: ReloadIn, x_auth: str = Header(None)):
+    updates = body.model_dump(exclude_none=True)
     with CONFIG_LOCK:
-        for k,v in body.model_dump(exclude_none=True).items():
+        for k,v in updates.items():
             if k in CONFIG: CONFIG[k]=v
+    # roots/前缀等变化会影响签名与解析结果：全部 root 标脏，下次搜索重新采集
+    _watch_mark_dirty(CONFIG.get("roots", []))
+    if _config_shared():
+        error = _save_runtime_config(updates)
+        if error:
+            return {"ok": True, "config": CONFIG, "shared": False, "shared_error": error}
     return {"ok": True, "config": CONFIG}
 
-@app.post("/api/search", dependencies=[Depends(require_auth)])
-def search(q: QueryIn, x_auth: str = Header(None)):
-    res, kw_date, year_filter = _collect_search_results(q)
+@app.get("/api/cache/stats", dependencies=[Depends(require_auth)])
+def cache_stats():
+    view = _load_rows_view()
+    with _WATCH_LOCK:
+        watch = {k: _WATCH_STATE[k] for k in ("active", "mode", "version", "events", "polls")}
+    return {"ok": True, "rows": {"sig": view["sig"], "count": len(view["rows"]), "version": view["version"],
+                                 "built_at": view["built_at"], "stale": _rows_stale(),
+                                 "shared": isinstance(view["rows"], _SharedRows), "pid": os.getpid()},
+            "build": _rows_build_stats(), "query_cache": _query_cache_stats(), "watch": watch,
+            "remarks": _remark_stats()}
+
+# —— 条件请求：读接口都带 ETag（数据签名 + 规范化的请求参数 + 过期标记），If-None-Match 命中时在检索前直接返回 304 ——
+def _etag(*parts) -> str:
+    """强校验 ETag：数据签名 + 请求参数的摘要"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
-    off=max(0, int(q.offset or 0)); lim=min(200, max(1, int(q.limit or 50)))
-    return {"count": len(res), "count_strict": sum(1 for _it in res if str(_it.get("序号","")).strip()), "items": res[off:off+lim], "offset": off, "limit": lim, "debug": {"kw_date": kw_date, "year_filter": (year_filter or {}).get("normalized", ""), "sample_cur": [(_norm_in_date(it.get("签订日期_norm","") or it.get("签订日期",""))) for it in res[:5]]}}  # DEBUG_DATE_SNIPPET
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
 
+def _query_from_params(request: Request) -> QueryIn:
+    """GET 变体：查询串字段与 QueryIn 同名（便于 Nginx 按 URL 微缓存）"""
+    try:
+        return QueryIn.model_validate(dict(request.query_params))
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=json.loads(exc.json()))
+
+def _search_response(q: QueryIn, response: Response, if_none_match: Optional[str]):
+    spec = _prepare_search(q)
+    view = _load_rows_view()
+    rows = view["rows"]
+    off=max(0, int(q.offset or 0)); lim=min(200, max(1, int(q.limit or 50)))
+    stale = _rows_stale()
+    etag = _etag("search", view["sig"], stale, _query_cache_key(spec), spec["kw_date"],
+                 (spec["year_filter"] or {}).get("normalized", ""), off, lim)
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
+    matches = _search_matches(spec, view)
+    ids = matches["ids"]
+
+    # 只格式化本页
+    page = [_format_result_row(rows[rid]) for rid in ids[off:off+lim]]
+    return {"count": len(ids), "count_strict": matches["count_strict"], "items": page, "offset": off, "limit": lim, "data_version": view["sig"], "data_stale": stale, "debug": {"kw_date": spec["kw_date"], "year_filter": (spec["year_filter"] or {}).get("normalized", ""), "sample_cur": [_norm_in_date(str(rows[rid].get("签订日期", "")).strip()) for rid in ids[:5]]}}  # DEBUG_DATE_SNIPPET
 
-@app.post("/api/search/export", dependencies=[Depends(require_auth)])
-def search_export(q: QueryIn):
-    from openpyxl import Workbook
+@app.post("/api/search", dependencies=[Depends(require_auth)])
+def search(q: QueryIn, response: Response, if_none_match: Optional[str] = Header(None)):
+    return _search_response(q, response, if_none_match)
+
+@app.get("/api/search", dependencies=[Depends(require_auth)])
+def search_get(request: Request, response: Response, if_none_match: Optional[str] = Header(None)):
+    return _search_response(_query_from_params(request), response, if_none_match)
+
+
+def _facets_response(q: QueryIn, response: Response, if_none_match: Optional[str]):
+    """按 甲方(国丰/华腾/蝶泉/其他)、签订年份、结清状态 分组的条数与金额合计；year=null 为日期无法识别的行。
+    结果挂在查询结果缓存条目上，同一数据签名下重复请求不再遍历"""
+    spec = _prepare_search(q)
+    view = _load_rows_view()
+    stale = _rows_stale()
+    etag = _etag("facets", view["sig"], stale, _query_cache_key(spec))
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
+    matches = _search_matches(spec, view)
+    facets = matches.get("facets")
+    if facets is None:
+        facets = matches["facets"] = _compute_facets(matches["ids"], view)
+    return dict(facets, ok=True, count=len(matches["ids"]), fields=_AMOUNT_RANGE_FIELDS,
+                data_version=view["sig"], data_stale=stale)
+
+@app.post("/api/search/facets", dependencies=[Depends(require_auth)])
+def search_facets(q: QueryIn, response: Response, if_none_match: Optional[str] = Header(None)):
+    return _facets_response(q, response, if_none_match)
+
+@app.get("/api/search/facets", dependencies=[Depends(require_auth)])
+def search_facets_get(request: Request, response: Response, if_none_match: Optional[str] = Header(None)):
+    return _facets_response(_query_from_params(request), response, if_none_match)
+
+
+_EXPORT_HEADERS = ["序号", "工程地点及内容", "单位名称", "签订日期", "合同额", "结算值", "已付款", "欠付款", "合同编号"]
+_EXPORT_COL_WIDTHS = {"A": 14, "B": 40, "C": 24, "D": 14, "E": 15, "F": 15, "G": 15, "H": 15, "I": 22}
+_EXPORT_SPOOL_BYTES = 8 * 1024 * 1024   # 导出文件超过该大小才落盘
+_EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _iter_search_results(view: Dict, ids):
+    """按命中顺序逐行产出展示字段，不生成中间列表"""
+    rows = view["rows"]
+    for rid in ids:
+        yield _format_result_row(rows[rid])
+
+
+def _export_styles() -> Dict:
+    """写入模式下单元格逐个带样式，样式对象预先建好复用"""
     from openpyxl.styles import Alignment, Font, PatternFill
+    return {
+        "font_header": Font(name="Microsoft YaHei", size=11, bold=True),
+        "font_body": Font(name="Microsoft YaHei", size=10),
+        "align_header": Alignment(horizontal="center", vertical="center", wrap_text=True),
+        "align_left": Alignment(horizontal="left", vertical="top", wrap_text=True),
+        "align_center": Alignment(horizontal="center", vertical="center", wrap_text=True),
+        "align_right": Alignment(horizontal="right", vertical="top", wrap_text=True),
+        "fill_settled": PatternFill(fill_type="solid", fgColor="EAF6EE"),
+    }
 
-    rows, kw_date, year_filter = _collect_search_results(q)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "搜索结果"
+def _styled_cell(ws, value, font, alignment, fill=None):
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(ws, value=value)
+    cell.font = font
+    cell.alignment = alignment
+    if fill is not None:
+        cell.fill = fill
+    return cell
 
-    headers = ["序号", "工程地点及内容", "单位名称", "签订日期", "合同额", "结算值", "已付款", "欠付款", "合同编号"]
-    ws.append(headers)
 
-    font_header = Font(name="Microsoft YaHei", size=11, bold=True)
-    font_body = Font(name="Microsoft YaHei", size=10)
-    align_header = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    align_left = Alignment(horizontal="left", vertical="top", wrap_text=True)
-    align_center = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    align_right = Alignment(horizontal="right", vertical="top", wrap_text=True)
-    fill_settled = PatternFill(fill_type="solid", fgColor="EAF6EE")
+def _write_export_xlsx(out, results, kw_date: str, year_filter) -> None:
+    """写入模式（write_only）生成导出工作簿：搜索结果 逐行写出，汇总 在同一遍里累计；结清行整行底色"""
+    from openpyxl import Workbook
+    st = _export_styles()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("搜索结果")
+    summary = wb.create_sheet("汇总")
 
-    ws.row_dimensions[1].height = 24
-    for col_idx, header in enumerate(headers, start=1):
-        cell = ws.cell(row=1, column=col_idx, value=header)
-        cell.font = font_header
-        cell.alignment = align_header
-
-    col_widths = {
-        "A": 14,
-        "B": 40,
-        "C": 24,
-        "D": 14,
-        "E": 15,
-        "F": 15,
-        "G": 15,
-        "H": 15,
-        "I": 22,
-    }
-    for col, width in col_widths.items():
+    for col, width in _EXPORT_COL_WIDTHS.items():
         ws.column_dimensions[col].width = width
-
-    for idx, item in enumerate(rows, start=2):
-        values = [item.get(k, "") for k in headers]
-        ws.append(values)
+    ws.row_dimensions[1].height = 24
+    ws.append([_styled_cell(ws, h, st["font_header"], st["align_header"]) for h in _EXPORT_HEADERS])
+
+    # 每列的对齐方式：金额列右对齐，序号/日期居中，其余左对齐
+    aligns = [st["align_right"] if i in (5, 6, 7, 8) else st["align_center"] if i in (1, 4) else st["align_left"]
+              for i in range(1, len(_EXPORT_HEADERS) + 1)]
+    party_totals = {name: [0, decimal.Decimal("0")] for name in ["总计", "国丰", "华腾", "蝶泉", "其他"]}
+    date_start = date_end = None
+    for idx, item in enumerate(results, start=2):
+        # 结清判定沿用展示值（与页面上看到的金额一致）
+        fill = st["fill_settled"] if _is_settled_row(item) else None
         ws.row_dimensions[idx].height = 36
-        settled = _is_settled_row(item)
-        for col_idx in range(1, len(headers) + 1):
-            cell = ws.cell(row=idx, column=col_idx)
-            cell.font = font_body
-            if col_idx in (5, 6, 7, 8):
-                cell.alignment = align_right
-            elif col_idx in (1, 4):
-                cell.alignment = align_center
-            else:
-                cell.alignment = align_left
-            if settled:
-                cell.fill = fill_settled
-
-    summary = wb.create_sheet("汇总")
-    summary.column_dimensions["A"].width = 18
-    summary.column_dimensions["B"].width = 20
-    summary.column_dimensions["C"].width = 18
-    summary.column_dimensions["D"].width = 18
-    summary.column_dimensions["E"].width = 18
-
-    summary_headers = ["分类", "合同总数", "欠付款总数", "起始日期", "结束日期"]
-    summary.append(summary_headers)
-    for cidx in range(1, len(summary_headers) + 1):
-        c = summary.cell(row=1, column=cidx)
-        c.font = font_header
-        c.alignment = align_header
-    summary.row_dimensions[1].height = 24
-
-    def classify_party(index_no: str) -> str:
-        t = (index_no or "").upper()
-        if "GF" in t:
-            return "国丰"
-        if "HT" in t:
-            return "华腾"
-        if "DQ" in t:
-            return "蝶泉"
-        return "其他"
-
-    parties = {"总计": rows, "国丰": [], "华腾": [], "蝶泉": [], "其他": []}
-    for row in rows:
-        parties[classify_party(str(row.get("序号", "")))].append(row)
-
-    date_values = [_norm_date(str(r.get("签订日期", ""))) for r in rows]
-    date_values = [d for d in date_values if d]
-    date_start = min(date_values) if date_values else (kw_date or "-")
-    date_end = max(date_values) if date_values else (kw_date or "-")
+        ws.append([_styled_cell(ws, item.get(k, ""), st["font_body"], align, fill)
+                   for k, align in zip(_EXPORT_HEADERS, aligns)])
+        unpaid = _parse_amount_decimal(item.get("欠付款", ""))
+        for name in ("总计", _classify_party(str(item.get("序号", "")))):
+            party_totals[name][0] += 1
+            party_totals[name][1] += unpaid
+        d = _norm_date(str(item.get("签订日期", "")))
+        if d:
+            date_start = d if date_start is None or d < date_start else date_start
+            date_end = d if date_end is None or d > date_end else date_end
+
+    date_start = date_start or (kw_date or "-")
+    date_end = date_end or (kw_date or "-")
     if year_filter and not year_filter.get("continuous", True):
         date_start = f"按年份筛选: {year_filter.get('normalized', '')}"
         date_end = "非连续年份"
 
-    summary_rows = []
-    for name in ["总计", "国丰", "华腾", "蝶泉", "其他"]:
-        group_rows = parties[name]
-        unpaid_sum = sum((_parse_amount_decimal(r.get("欠付款", "")) for r in group_rows), decimal.Decimal("0"))
-        summary_rows.append([name, len(group_rows), f"{unpaid_sum:.2f}", date_start or "-", date_end or "-"])
+    for col, width in {"A": 18, "B": 20, "C": 18, "D": 18, "E": 18}.items():
+        summary.column_dimensions[col].width = width
+    summary.row_dimensions[1].height = 24
+    summary.append([_styled_cell(summary, h, st["font_header"], st["align_header"])
+                    for h in ["分类", "合同总数", "欠付款总数", "起始日期", "结束日期"]])
+    for ridx, (name, (count, unpaid_sum)) in enumerate(party_totals.items(), start=2):
+        summary.row_dimensions[ridx].height = 22
+        values = [name, count, f"{unpaid_sum:.2f}", date_start or "-", date_end or "-"]
+        summary.append([_styled_cell(summary, v, st["font_body"], st["align_center"] if cidx != 3 else st["align_right"])
+                        for cidx, v in enumerate(values, start=1)])
+    wb.save(out)
 
-    for row in summary_rows:
-        summary.append(row)
 
-    for ridx in range(2, 2 + len(summary_rows)):
-        summary.row_dimensions[ridx].height = 22
-        for cidx in range(1, 6):
-            c = summary.cell(row=ridx, column=cidx)
-            c.font = font_body
-            c.alignment = align_center if cidx != 3 else align_right
+def _stream_file(f, chunk_size: int = _EXPORT_CHUNK_BYTES):
+    """分块读出已写好的临时文件，读完关闭（SpooledTemporaryFile 关闭即删除）"""
+    try:
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+# 纯数据导出：RETURN_FIELDS + 来源定位字段，值与 /api/search 返回的 items 一致
+_EXPORT_DATA_FIELDS = RETURN_FIELDS + ["__source_file", "__row_index"]
+_EXPORT_BATCH_ROWS = 500
+_EXPORT_MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _iter_export_text(fmt: str, results):
+    """csv / ndjson 文本，按批（_EXPORT_BATCH_ROWS 行）产出，内存与结果条数无关"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\r\n") if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(_EXPORT_DATA_FIELDS)
+    pending = 0
+    for item in results:
+        if writer is not None:
+            writer.writerow([item.get(k, "") for k in _EXPORT_DATA_FIELDS])
+        else:
+            buf.write(json.dumps(item, ensure_ascii=False))
+            buf.write("\n")
+        pending += 1
+        if pending >= _EXPORT_BATCH_ROWS:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _gzip_chunks(chunks):
+    """流式 gzip：每批数据压缩后立即产出"""
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = comp.compress(chunk)
+        if data:
+            yield data
+    yield comp.flush()
+
+
+_XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _export_format(fmt: str, gz: bool):
+    """校验导出参数 → (格式, 是否 gzip, 扩展名, Content-Type)；xlsx 本身是 zip，忽略 gzip"""
+    fmt = (fmt or "xlsx").strip().lower()
+    if fmt == "xlsx":
+        return fmt, False, "xlsx", _XLSX_MEDIA_TYPE
+    if fmt not in _EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+    if gz:
+        return fmt, True, f"{fmt}.gz", "application/gzip"
+    return fmt, False, fmt, _EXPORT_MEDIA_TYPES[fmt]
+
+
+def _export_chunks(fmt: str, gz: bool, results):
+    body = _iter_export_text(fmt, results)
+    return _gzip_chunks(body) if gz else body
+
+
+def _write_export(f, fmt: str, gz: bool, results, spec: Dict) -> None:
+    """把导出内容完整写入文件对象 f"""
+    if fmt == "xlsx":
+        _write_export_xlsx(f, results, spec["kw_date"], spec["year_filter"])
+        return
+    for chunk in _export_chunks(fmt, gz, results):
+        f.write(chunk)
+
+
+def _export_disposition(ext: str, stamp: str = "") -> str:
+    encoded_filename = quote(f"搜索结果导出_{stamp or datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}")
+    return f"attachment; filename=export.{ext}; filename*=UTF-8''{encoded_filename}"
+
+
+@app.post("/api/search/export", dependencies=[Depends(require_auth)])
+def search_export(q: QueryIn, fmt: str = Query("xlsx", alias="format"), gz: bool = Query(False, alias="gzip")):
+    """format=xlsx（默认，带样式和汇总表）/ csv / ndjson；csv、ndjson 边检索边输出，gzip=true 时压缩为 .gz"""
+    fmt, gz, ext, media_type = _export_format(fmt, gz)
+    spec = _prepare_search(q)
+    view = _load_rows_view()
+    ids = _search_matches(spec, view)["ids"]
+
+    if fmt != "xlsx":
+        headers_resp = {"Content-Disposition": _export_disposition(ext), "X-Result-Count": str(len(ids))}
+        return StreamingResponse(_export_chunks(fmt, gz, _iter_search_results(view, ids)), media_type=media_type, headers=headers_resp)
+
+    out = tempfile.SpooledTemporaryFile(max_size=_EXPORT_SPOOL_BYTES)
+    try:
+        _write_export(out, fmt, gz, _iter_search_results(view, ids), spec)
+    except Exception:
+        out.close()
+        raise
+    headers_resp = {"Content-Disposition": _export_disposition(ext), "Content-Length": str(out.tell())}
+    return StreamingResponse(_stream_file(out), media_type=media_type, headers=headers_resp)
+
+
+# —— 异步导出任务：提交 → 轮询进度 → 下载。任务状态与成品都在 DATA/exports，多 worker 下任一进程都能应答轮询/下载 ——
+# 任务号 = 查询条件 + 格式 + 数据签名 的摘要：相同导出直接复用已生成的文件或正在进行的任务
+_EXPORT_JOB_RE = re.compile(r"^[0-9a-f]{32}$")
+_EXPORT_POOL_LOCK = threading.Lock()
+_EXPORT_POOL_STATE = {"pool": None, "workers": 0}
+_EXPORT_ACTIVE: set = set()     # 本进程排队/执行中的任务号
+_EXPORT_PROGRESS_INTERVAL = 1.0
+
+
+def _export_dir() -> str:
+    return os.path.join(_resolve_data_dir(), "exports")
+
+
+def _export_job_path(job_id: str) -> str:
+    return os.path.join(_export_dir(), f"{job_id}.json")
+
+
+def _export_job_id(spec: Dict, view: Dict, fmt: str, gz: bool) -> str:
+    summary = [spec["kw_date"], (spec["year_filter"] or {}).get("normalized", "")]
+    raw = json.dumps([_query_cache_key(spec), summary, fmt, gz, view["sig"]], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _load_export_job(job_id: str) -> Optional[Dict]:
+    try:
+        with open(_export_job_path(job_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_export_job(job: Dict) -> None:
+    path = _export_job_path(job["job_id"])
+    job["updated_at"] = _utc_now_ts()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, TypeError, ValueError):
+        return True
+    return True
+
+
+def _export_job_usable(job: Optional[Dict]) -> bool:
+    """done 且文件还在，或者仍在某个存活进程里排队/执行"""
+    if not job:
+        return False
+    if job.get("status") == "done":
+        return os.path.isfile(os.path.join(_export_dir(), job.get("artifact", "")))
+    if job.get("status") in ("queued", "running"):
+        return job.get("job_id") in _EXPORT_ACTIVE if job.get("pid") == os.getpid() else _pid_alive(job.get("pid"))
+    return False
+
+
+def _export_pool() -> ThreadPoolExecutor:
+    workers = max(1, int(CONFIG.get("export_workers", 2) or 1))
+    with _EXPORT_POOL_LOCK:
+        if _EXPORT_POOL_STATE["pool"] is None or _EXPORT_POOL_STATE["workers"] != workers:
+            old = _EXPORT_POOL_STATE["pool"]
+            _EXPORT_POOL_STATE["pool"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+            _EXPORT_POOL_STATE["workers"] = workers
+            if old is not None:
+                old.shutdown(wait=False)
+        return _EXPORT_POOL_STATE["pool"]
+
+
+def _run_export_job(job: Dict, spec: Dict, view: Dict) -> None:
+    artifact = os.path.join(_export_dir(), job["artifact"])
+    tmp = f"{artifact}.{os.getpid()}.tmp"
+    try:
+        ids = _search_matches(spec, view)["ids"]
+        job.update(status="running", total=len(ids), done=0)
+        _save_export_job(job)
+
+        def counted(results):
+            last = time.time()
+            for n, item in enumerate(results, start=1):
+                yield item
+                if time.time() - last >= _EXPORT_PROGRESS_INTERVAL:
+                    job["done"] = n
+                    _save_export_job(job)
+                    last = time.time()
+
+        with open(tmp, "wb") as f:
+            _write_export(f, job["format"], job["gzip"], counted(_iter_search_results(view, ids)), spec)
+        os.replace(tmp, artifact)
+        job.update(status="done", done=len(ids), size=os.path.getsize(artifact), finished_at=_utc_now_ts())
+    except Exception as exc:
+        job.update(status="error", error=repr(exc), finished_at=_utc_now_ts())
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    finally:
+        _save_export_job(job)
+        with _EXPORT_POOL_LOCK:
+            _EXPORT_ACTIVE.discard(job["job_id"])
+        _evict_export_cache()
 
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
 
-    filename = f"搜索结果导出_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    encoded_filename = quote(filename)
-    headers_resp = {"Content-Disposition": f"attachment; filename=export.xlsx; filename*=UTF-8''{encoded_filename}"}
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers_resp)
+def _evict_export_cache() -> None:
+    """删除超龄的导出文件/任务记录，再按最久未用淘汰到总大小不超过上限；进行中的任务不动"""
+    d = _export_dir()
+    try:
+        names = os.listdir(d)
+    except OSError:
+        return
+    now = time.time()
+    max_age = float(CONFIG.get("export_cache_max_age_hours", 24) or 0) * 3600
+    max_bytes = float(CONFIG.get("export_cache_max_mb", 1024) or 0) * 1024 * 1024
+    artifacts = []
+    for name in names:
+        path = os.path.join(d, name)
+        job_id = name.split(".", 1)[0]
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        expired = max_age > 0 and now - st.st_mtime > max_age
+        if name.endswith(".json"):
+            job = _load_export_job(job_id)
+            if expired and not (job and job.get("status") in ("queued", "running") and _export_job_usable(job)):
+                _remove_export_files(job_id)
+        elif name.endswith(".tmp"):
+            if expired:
+                _remove_export_files(name)
+        elif expired:
+            _remove_export_files(job_id)
+        else:
+            artifacts.append((st.st_mtime, st.st_size, job_id))
+    if max_bytes <= 0:
+        return
+    total = sum(size for _, size, _ in artifacts)
+    for _, size, job_id in sorted(artifacts):
+        if total <= max_bytes:
+            break
+        _remove_export_files(job_id)
+        total -= size
+
+
+def _remove_export_files(name: str) -> None:
+    """name 为任务号时删除其成品与任务记录，否则只删除该文件"""
+    d = _export_dir()
+    if not _EXPORT_JOB_RE.match(name):
+        paths = [os.path.join(d, name)]
+    else:
+        try:
+            paths = [os.path.join(d, n) for n in os.listdir(d) if n.split(".", 1)[0] == name and not n.endswith(".tmp")]
+        except OSError:
+            return
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _export_job_status(job: Dict) -> Dict:
+    total = job.get("total")
+    progress = 1.0 if job.get("status") == "done" else (round(job.get("done", 0) / total, 4) if total else 0.0)
+    out = {k: job.get(k) for k in ("job_id", "status", "format", "gzip", "total", "done", "size", "error",
+                                   "data_version", "created_at", "finished_at")}
+    out.update(ok=True, progress=progress)
+    if job.get("status") == "done":
+        out["download_url"] = f"/api/export/jobs/{job['job_id']}/download"
+    return out
+
+
+@app.post("/api/export/jobs", dependencies=[Depends(require_auth)])
+def export_job_submit(q: QueryIn, fmt: str = Query("xlsx", alias="format"), gz: bool = Query(False, alias="gzip")):
+    """提交导出任务（参数同 /api/search/export），立即返回任务状态；相同条件且数据未变时复用已有文件或进行中的任务"""
+    fmt, gz, ext, _ = _export_format(fmt, gz)
+    spec = _prepare_search(q)
+    view = _load_rows_view()
+    job_id = _export_job_id(spec, view, fmt, gz)
+    with _EXPORT_POOL_LOCK:
+        job = _load_export_job(job_id)
+        if _export_job_usable(job):
+            if job.get("status") == "done":
+                try:
+                    os.utime(os.path.join(_export_dir(), job["artifact"]))   # 复用也算一次使用，推迟淘汰
+                except OSError:
+                    pass
+            return _export_job_status(job)
+        job = {"job_id": job_id, "status": "queued", "format": fmt, "gzip": gz, "artifact": f"{job_id}.{ext}",
+               "total": None, "done": 0, "size": None, "error": None, "data_version": view["sig"],
+               "pid": os.getpid(), "created_at": _utc_now_ts(), "finished_at": None}
+        _save_export_job(job)
+        _EXPORT_ACTIVE.add(job_id)
+    _export_pool().submit(_run_export_job, job, spec, view)
+    return _export_job_status(job)
+
+
+def _require_export_job(job_id: str) -> Dict:
+    job = _load_export_job(job_id) if _EXPORT_JOB_RE.match(job_id or "") else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.get("status") in ("queued", "running") and not _export_job_usable(job):
+        job.update(status="error", error="export worker exited")
+    return job
+
+
+@app.get("/api/export/jobs/{job_id}", dependencies=[Depends(require_auth)])
+def export_job_status(job_id: str):
+    return _export_job_status(_require_export_job(job_id))
+
+
+@app.get("/api/export/jobs/{job_id}/download", dependencies=[Depends(require_auth)])
+def export_job_download(job_id: str):
+    job = _require_export_job(job_id)
+    if job.get("status") != "done":
+        raise HTTPException(status_code=409, detail=f"Export job {job.get('status')}")
+    path = os.path.join(_export_dir(), job["artifact"])
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=410, detail="Export file expired")
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    fmt, gz = job["format"], job["gzip"]
+    ext = job["artifact"].split(".", 1)[1]
+    media_type = _XLSX_MEDIA_TYPE if fmt == "xlsx" else "application/gzip" if gz else _EXPORT_MEDIA_TYPES[fmt]
+    stamp = datetime.datetime.fromtimestamp(job.get("finished_at") or time.time()).strftime('%Y%m%d_%H%M%S')
+    return FileResponse(path, media_type=media_type, headers={"Content-Disposition": _export_disposition(ext, stamp)})
 
 def _resolve_source_file(source_file: str) -> str:
     if not source_file:
@@ -1057,101 +3084,372 @@ def _remark_is_meaningful(value: str) -> bool:
     cleaned = re.sub(r"[\\s,，、;；/|]+", "", text)
     return bool(cleaned)
 
-@app.post("/api/entry/detail", dependencies=[Depends(require_auth)])
-def entry_detail(body: EntryDetailIn):
-    from openpyxl import load_workbook
+# 行缓存分区之外按需读取的详情行存储（共享快照 worker、分区缺失或文件已改动时），按最近使用保留
+_DETAIL_CACHE: "OrderedDict[str, Dict]" = OrderedDict()
+_DETAIL_CACHE_LOCK = threading.Lock()
+_DETAIL_CACHE_ENTRIES = 16
 
+def _detail_fresh(detail: Optional[Dict], real: str) -> bool:
+    if not detail:
+        return False
+    try:
+        st = os.stat(real)
+    except OSError:
+        return False
+    return detail.get("stat") == (st.st_mtime_ns, st.st_size)
+
+def _entry_detail_store(source_file: str, real: str) -> Optional[Dict]:
+    """先查行缓存分区，再查按需缓存；都不可用时从磁盘读一次并缓存"""
+    with _ROWS_LOCK:
+        parts = _ROWS_CACHE.get("parts") or {}
+        part = parts.get(source_file) or parts.get(real)
+    detail = part.get("detail") if part else None
+    if _detail_fresh(detail, real):
+        return detail
+    with _DETAIL_CACHE_LOCK:
+        detail = _DETAIL_CACHE.get(real)
+        if detail is not None:
+            _DETAIL_CACHE.move_to_end(real)
+    if _detail_fresh(detail, real):
+        return detail
+    detail = _read_detail_store(real)
+    if detail is None:
+        return None
+    with _DETAIL_CACHE_LOCK:
+        _DETAIL_CACHE[real] = detail
+        _DETAIL_CACHE.move_to_end(real)
+        while len(_DETAIL_CACHE) > _DETAIL_CACHE_ENTRIES:
+            _DETAIL_CACHE.popitem(last=False)
+    return detail
+
+def _entry_remark_value(detail: Dict, real: str, row_index: int):
+    """(备注, 是否有备注列)：工作簿中的值叠加日志里尚未写回的备注"""
+    headers = detail["headers"]
+    values = detail["rows"].get(row_index) or ("",) * len(detail["cols"])
+    remark_value = ""
+    has_remark_column = False
+    for idx, value in zip(detail["cols"], values):
+        if headers[idx] == "备注":
+            has_remark_column = True
+            remark_value = _detail_display("备注", value)
+    for pending in _pending_remarks(real, row_index):
+        merged = _merge_remark(remark_value, pending)
+        if merged is not None:
+            remark_value = merged
+            has_remark_column = True
+    return remark_value, has_remark_column
+
+@app.post("/api/entry/detail", dependencies=[Depends(require_auth)])
+def entry_detail(body: EntryDetailIn, response: Response, if_none_match: Optional[str] = Header(None)):
     real = _resolve_source_file(body.source_file)
     row_index = int(body.row_index or 0)
     if row_index < 2:
         raise HTTPException(status_code=400, detail="Invalid row index")
 
-    wb = load_workbook(real, read_only=True, data_only=True)
-    ws = wb.active
-    if row_index > ws.max_row:
+    detail = _entry_detail_store(body.source_file, real)
+    if detail is None:
+        raise HTTPException(status_code=500, detail="Failed to read source file")
+    if row_index > detail["max_row"]:
         raise HTTPException(status_code=404, detail="Row not found")
 
-    headers = []
-    for cell in ws[1]:
-        val = "" if cell.value is None else str(cell.value).strip()
-        headers.append(val)
-
-    row_cells = None
-    for row in ws.iter_rows(min_row=row_index, max_row=row_index, values_only=False):
-        row_cells = row
-        break
-    if row_cells is None:
-        raise HTTPException(status_code=404, detail="Row not found")
+    # 详情只取决于该工作簿的内容（stat）与尚未写回的备注
+    etag = _etag("detail", real, detail["stat"], row_index, _pending_remarks(real, row_index))
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
 
+    headers = detail["headers"]
+    values = detail["rows"].get(row_index) or ("",) * len(detail["cols"])
     fields = []
-    remark_value = ""
-    has_remark_column = False
-    for idx, header in enumerate(headers):
-        if not header:
+    for idx, value in zip(detail["cols"], values):
+        header = headers[idx]
+        if header != "备注":
+            fields.append({"label": header, "value": _detail_display(header, value)})
+    remark_value, has_remark_column = _entry_remark_value(detail, real, row_index)
+
+    return {"ok": True, "fields": fields, "remark": remark_value, "has_remark_column": has_remark_column}
+
+def _merge_remark(existing: str, new: str) -> Optional[str]:
+    """在已有备注上追加新备注（逗号分隔）；新备注为空、与已有相同或已包含在内时返回 None"""
+    if not _remark_is_meaningful(new):
+        return None
+    if _remark_is_meaningful(existing):
+        if existing == new or new in existing:
+            return None
+        return f"{existing},{new}"
+    return new
+
+# —— 备注日志：接口只追加一行到 DATA/remarks_journal.jsonl 并 fsync，详情立即叠加未写回的备注；
+# 后台按批写回：每个工作簿一次 load/save，持有与 bin/ingest_excels.py 相同的 <index.xlsx>.lock。
+# 写回成功的条目从日志中移除；写回是幂等的（已包含的备注不会重复追加），中途崩溃重放即可 ——
+_REMARK_LOCK = threading.Lock()
+_REMARK_STATE = {"key": None, "pending": {}, "timer": None, "flushes": 0, "last_error": "", "failures": {},
+                 "timer_due": 0.0}
+_REMARK_BACKOFF_MAX = 3600    # 写回失败的工作簿重试间隔上限（秒）
+
+def _remark_journal_path() -> str:
+    return os.path.join(_resolve_data_dir(), "remarks_journal.jsonl")
+
+def _read_remark_journal() -> List[Dict]:
+    """日志中尚未写回的条目（按追加顺序）；崩溃留下的半行跳过"""
+    entries = []
+    try:
+        with open(_remark_journal_path(), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and entry.get("id") and entry.get("source_file"):
+                    entries.append(entry)
+    except OSError:
+        pass
+    return entries
+
+def _pending_remarks(real: str, row_index: int) -> List[str]:
+    """某行尚未写回工作簿的备注；日志文件变化（任意 worker 追加或写回）时重新读取"""
+    try:
+        st = os.stat(_remark_journal_path())
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    with _REMARK_LOCK:
+        if key != _REMARK_STATE["key"]:
+            pending: Dict[tuple, List[str]] = {}
+            for entry in (_read_remark_journal() if key is not None else []):
+                pending.setdefault((entry["source_file"], int(entry.get("row_index", 0))), []).append(entry.get("remark", ""))
+            _REMARK_STATE["key"] = key
+            _REMARK_STATE["pending"] = pending
+        return list(_REMARK_STATE["pending"].get((real, row_index), ()))
+
+def _append_remark(real: str, row_index: int, remark: str) -> None:
+    path = _remark_journal_path()
+    line = json.dumps({"id": uuid.uuid4().hex, "ts": _utc_now_ts(), "source_file": real, "row_index": row_index,
+                       "remark": remark}, ensure_ascii=False) + "\n"
+    lock = _process_lock("remarks.lock")
+    try:
+        with open(path, "a+b") as f:
+            # 上次写到一半崩溃留下的半行先补换行，否则本条会被拼进那行一起作废
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        if lock is not None:
+            lock.close()
+
+def _drop_remark_entries(done_ids: set) -> int:
+    """从日志中移除已写回的条目（期间新追加的保留），返回剩余条数"""
+    path = _remark_journal_path()
+    lock = _process_lock("remarks.lock")
+    try:
+        remaining = [e for e in _read_remark_journal() if e["id"] not in done_ids]
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for e in remaining:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return len(remaining)
+    finally:
+        if lock is not None:
+            lock.close()
+
+def _workbook_lock(path: str, timeout: float = 5.0) -> Optional[str]:
+    """<工作簿>.lock：O_EXCL 创建并写入 pid，与 bin/ingest_excels.py 互斥；持有者进程已退出的锁视为残留。
+    超时返回 None，成功返回锁文件路径（删除即释放）"""
+    lock = path + ".lock"
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                with open(lock, "r", encoding="utf-8") as f:
+                    pid = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pid = 0
+            if pid and not _pid_alive(pid):
+                try:
+                    os.unlink(lock)
+                except OSError:
+                    pass
+                continue
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.1)
             continue
-        value = ""
-        if idx < len(row_cells):
-            cell = row_cells[idx]
-            value = _format_cell_for_display(header, cell.value, cell.number_format)
-        if header == "备注":
-            has_remark_column = True
-            remark_value = value
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+        return lock
+
+def _apply_remarks_to_workbook(real: str, entries: List[Dict]) -> bool:
+    """一次打开/保存把多条备注写回同一工作簿；返回是否有改动"""
+    from openpyxl import load_workbook
+    wb = load_workbook(real)
+    ws = wb.active
+    headers = ["" if cell.value is None else str(cell.value).strip() for cell in ws[1]]
+    remark_idx = headers.index("备注") + 1 if "备注" in headers else None
+    changed = False
+    for entry in entries:
+        row_index = int(entry.get("row_index", 0))
+        if row_index < 2 or row_index > ws.max_row:
             continue
-        fields.append({"label": header, "value": value})
+        if remark_idx is None:
+            remark_idx = len(headers) + 1
+            ws.cell(row=1, column=remark_idx, value="备注")
+        existing_value = ws.cell(row=row_index, column=remark_idx).value
+        merged = _merge_remark("" if existing_value is None else str(existing_value).strip(), entry.get("remark", ""))
+        if merged is not None:
+            ws.cell(row=row_index, column=remark_idx, value=merged)
+            changed = True
+    if changed:
+        wb.save(real)
+    wb.close()
+    return changed
+
+def _flush_remarks() -> int:
+    """把日志中的备注按工作簿分组写回；拿不到工作簿锁或写回失败的留待下次。返回剩余条数"""
+    owner = _process_lock("remarks_flush.lock", blocking=False)
+    if owner is None:
+        return -1   # 其他进程正在写回
+    try:
+        entries = _read_remark_journal()
+        if not entries:
+            return 0
+        by_file: Dict[str, List[Dict]] = {}
+        for entry in entries:
+            by_file.setdefault(entry["source_file"], []).append(entry)
+        done_ids = set()
+        now = time.time()
+        for real, items in by_file.items():
+            if not os.path.isfile(real):
+                done_ids.update(e["id"] for e in items)     # 工作簿已不存在：丢弃
+                continue
+            if _remark_backoff_until(real) > now:
+                continue
+            lock = _workbook_lock(real)
+            if lock is None:
+                continue
+            try:
+                if _apply_remarks_to_workbook(real, items):
+                    _invalidate_rows_partition(real)
+                done_ids.update(e["id"] for e in items)
+                with _REMARK_LOCK:
+                    _REMARK_STATE["failures"].pop(real, None)
+            except Exception as exc:
+                _remark_flush_failed(real, len(items), exc)
+            finally:
+                try:
+                    os.unlink(lock)
+                except OSError:
+                    pass
+        with _REMARK_LOCK:
+            _REMARK_STATE["flushes"] += 1
+        return _drop_remark_entries(done_ids) if done_ids else len(entries)
+    finally:
+        owner.close()
 
-    return {"ok": True, "fields": fields, "remark": remark_value, "has_remark_column": has_remark_column}
+def _workbook_stat_key(real: str):
+    try:
+        st = os.stat(real)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _remark_backoff_until(real: str) -> float:
+    """写回失败的工作簿在退避期内跳过；文件被替换/修复（mtime/size 变化）后立即重试"""
+    with _REMARK_LOCK:
+        failure = _REMARK_STATE["failures"].get(real)
+        if failure is None:
+            return 0.0
+        if failure["stat"] != _workbook_stat_key(real):
+            _REMARK_STATE["failures"].pop(real, None)
+            return 0.0
+        return failure["next_at"]
+
+def _remark_flush_failed(real: str, pending: int, exc: Exception) -> None:
+    """记录失败并按 remark_flush_delay × 2^次数 退避（上限 _REMARK_BACKOFF_MAX），写日志"""
+    delay = max(1.0, float(CONFIG.get("remark_flush_delay", 5) or 0))
+    with _REMARK_LOCK:
+        failure = _REMARK_STATE["failures"].get(real) or {"attempts": 0}
+        failure["attempts"] += 1
+        wait = min(_REMARK_BACKOFF_MAX, delay * (2 ** failure["attempts"]))
+        failure.update(next_at=time.time() + wait, error=repr(exc), stat=_workbook_stat_key(real))
+        _REMARK_STATE["failures"][real] = failure
+        _REMARK_STATE["last_error"] = f"{real}: {exc!r}"
+        attempts = failure["attempts"]
+    _auto_update_log(f"备注写回失败: {real} 待写 {pending} 条，第 {attempts} 次，{wait:.0f}s 后重试 ({exc!r})")
+
+def _remark_stats() -> Dict:
+    pending = len(_read_remark_journal())
+    with _REMARK_LOCK:
+        failures = {k: {"attempts": v["attempts"], "next_at": v["next_at"], "error": v["error"]}
+                    for k, v in _REMARK_STATE["failures"].items()}
+        return {"pending": pending, "flushes": _REMARK_STATE["flushes"], "last_error": _REMARK_STATE["last_error"],
+                "flush_scheduled": _REMARK_STATE["timer"] is not None, "failures": failures}
+
+def _remark_flush_job() -> None:
+    with _REMARK_LOCK:
+        if _REMARK_STATE["timer"] is threading.current_thread():
+            _REMARK_STATE["timer"] = None
+    try:
+        remaining = _flush_remarks()
+    except Exception as exc:
+        with _REMARK_LOCK:
+            _REMARK_STATE["last_error"] = repr(exc)
+        _auto_update_log(f"备注写回失败: {exc!r}")
+        remaining = -1
+    if remaining != 0:
+        # 剩下的全是退避中的工作簿时，等到最早的重试时间再醒
+        now = time.time()
+        waits = [_remark_backoff_until(real) - now for real in {e["source_file"] for e in _read_remark_journal()}]
+        _schedule_remark_flush(min(waits) if waits and min(waits) > 0 else None)
+
+def _schedule_remark_flush(delay: Optional[float] = None) -> None:
+    """remark_flush_delay 秒（或 delay，取较大者）后写回；已安排的写回不晚于此时则不重复安排
+    （这段时间内的备注一起写回），晚于此时（退避中）则提前"""
+    wait = max(0.0, float(CONFIG.get("remark_flush_delay", 5) or 0), delay or 0.0)
+    due = time.time() + wait
+    with _REMARK_LOCK:
+        timer = _REMARK_STATE["timer"]
+        if timer is not None:
+            if _REMARK_STATE["timer_due"] <= due:
+                return
+            timer.cancel()
+        timer = threading.Timer(wait, _remark_flush_job)
+        timer.daemon = True
+        _REMARK_STATE["timer"] = timer
+        _REMARK_STATE["timer_due"] = due
+    timer.start()
 
 @app.post("/api/entry/remark", dependencies=[Depends(require_auth)])
 def entry_remark(body: EntryRemarkIn):
-    from openpyxl import load_workbook
-
     real = _resolve_source_file(body.source_file)
     row_index = int(body.row_index or 0)
     if row_index < 2:
         raise HTTPException(status_code=400, detail="Invalid row index")
 
-    wb = load_workbook(real)
-    ws = wb.active
-    if row_index > ws.max_row:
+    detail = _entry_detail_store(body.source_file, real)
+    if detail is None:
+        raise HTTPException(status_code=500, detail="Failed to read source file")
+    if row_index > detail["max_row"]:
         raise HTTPException(status_code=404, detail="Row not found")
 
-    headers = []
-    for cell in ws[1]:
-        headers.append("" if cell.value is None else str(cell.value).strip())
-
-    remark_idx = None
-    for idx, header in enumerate(headers, start=1):
-        if header == "备注":
-            remark_idx = idx
-            break
-    if remark_idx is None:
-        remark_idx = len(headers) + 1
-        ws.cell(row=1, column=remark_idx, value="备注")
-
     new_remark = (body.remark or "").strip()
     if not _remark_is_meaningful(new_remark):
         return {"ok": True, "updated": False}
 
-    existing_value = ws.cell(row=row_index, column=remark_idx).value
-    existing_remark = "" if existing_value is None else str(existing_value).strip()
-
-    if _remark_is_meaningful(existing_remark):
-        if existing_remark == new_remark:
-            return {"ok": True, "updated": False}
-        if new_remark in existing_remark:
-            return {"ok": True, "updated": False}
-        combined = f"{existing_remark},{new_remark}"
-        ws.cell(row=row_index, column=remark_idx, value=combined)
-    else:
-        ws.cell(row=row_index, column=remark_idx, value=new_remark)
-
-    wb.save(real)
-
-    with _ROWS_LOCK:
-        _ROWS_CACHE["sig"] = None
-        _ROWS_CACHE["rows"] = []
+    if _merge_remark(_entry_remark_value(detail, real, row_index)[0], new_remark) is None:
+        return {"ok": True, "updated": False}
 
-    return {"ok": True}
+    _append_remark(real, row_index, new_remark)
+    _schedule_remark_flush()
+    return {"ok": True, "pending": True}
 
 @app.get("/api/auto-update/status", dependencies=[Depends(require_auth)])
 def auto_update_status():
@@ -1325,42 +3623,24 @@ def maint_append(a: MaintAuth):
 
 
 @app.get("/api/entries/count")
-def entries_count():
-    from pathlib import Path
-    from openpyxl import load_workbook
-
-    STD_HEADER = ["序号","工程地点及内容","单位名称","签订途径","启动时间","结果确定时间","签订日期","控制价","合同额","结算值","已付款","欠付款","备注"]
-
-    def trim(row):
-        vals=[("" if v is None else str(v).strip()) for v in row]
-        while vals and vals[-1]=="":
-            vals.pop()
-        return vals
+def entries_count(response: Response, if_none_match: Optional[str] = Header(None)):
+    """各年份 index.xlsx 的数据行数：索引时已算好，直接从行缓存返回；数据未变时 If-None-Match 命中返回 304"""
+    view = _load_rows_view()
 
-    root = Path("/data/contracts")
-    per, total_all, total_strict = [], 0, 0
+    def build(rows):
+        per = view.get("entries") or []
+        total_all = sum(e.get("rows", 0) for e in per)
+        total_strict = sum(e.get("rows", 0) for e in per if e.get("strict"))
+        payload = {"ok": True, "total_all": total_all, "total_strict": total_strict, "per_year": per}
+        return {"payload": payload, "etag": _etag("entries_count", view["sig"], payload)}
 
-    years = sorted([p for p in root.iterdir() if p.is_dir() and p.name.isdigit()], key=lambda x:int(x.name))
-    for y in years:
-        idx = None
-        for f in y.iterdir():
-            if f.is_file() and f.name.lower()=="index.xlsx":
-                idx=f; break
-        if not idx:
-            continue
-        try:
-            wb=load_workbook(idx, read_only=True, data_only=True); ws=wb.active
-            hdr = trim([c.value for c in ws[1]])
-            strict = (len(hdr)==len(STD_HEADER) and all(hdr[i]==STD_HEADER[i] for i in range(len(STD_HEADER))))
-            n = sum(1 for r in ws.iter_rows(min_row=2, values_only=True) if r and r[0] not in (None, ""))
-            total_all += n
-            if strict:
-                total_strict += n
-            per.append({"year": int(y.name), "rows": n, "strict": strict, "file": str(idx)})
-        except Exception as e:
-            per.append({"year": int(y.name), "error": str(e), "file": str(idx)})
-
-    return {"ok": True, "total_all": total_all, "total_strict": total_strict, "per_year": per}
+    cached = _rows_derived(view, "entries_count", build)
+    # no-cache：浏览器每次带 If-None-Match 回源校验，数据未变只收到 304
+    headers = {"ETag": cached["etag"], "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, cached["etag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return cached["payload"]
 
 
 
@@ -1375,4 +3655,22 @@ def do_login(password: str = Form(...)):
 
 
 AUTO_UPDATE_ENABLED = _load_auto_update_enabled()
-threading.Thread(target=_auto_update_loop, daemon=True).start()
+_AUTO_UPDATE_OWNER = None
+
+@app.on_event("startup")
+def _start_background_tasks():
+    # 多 worker 时只有拿到 auto_update.lock 的进程运行自动更新任务（锁随进程退出释放）
+    global _AUTO_UPDATE_OWNER
+    _AUTO_UPDATE_OWNER = _process_lock("auto_update.lock", blocking=False)
+    if _AUTO_UPDATE_OWNER is not None:
+        threading.Thread(target=_auto_update_loop, daemon=True).start()
+    # 启动即从磁盘快照预热行缓存，首个搜索无需再解析全部 index.xlsx
+    def warm():
+        try:
+            _load_rows_view()
+        except Exception:
+            pass
+    threading.Thread(target=warm, daemon=True).start()
+    # 上次退出前未写回的备注
+    if _read_remark_journal():
+        _schedule_remark_flush()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""index.xlsx 读取基准：生成大体量合成索引，对比 openpyxl(read_only) 与 xlsx_stream 的解析耗时并校验结果一致。
+
+用法：
+  python bin/bench_xlsx_reader.py                  # 默认 50000 行
+  python bin/bench_xlsx_reader.py --rows 200000 --repeat 3
+  python bin/bench_xlsx_reader.py --file /data/contracts/2024/index.xlsx
+"""
+import os, sys, time, random, argparse, tempfile, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+HEADER = ["序号", "工程地点及内容", "单位名称", "签订途径", "启动时间", "结果确定时间", "签订日期",
+          "控制价", "合同额", "结算值", "已付款", "欠付款", "备注"]
+PARTIES = ["GF", "HT", "DQ", "QT"]
+PLACES = ["北京市朝阳区道路维修", "上海浦东绿化养护", "成都高新区管网改造", "西安雁塔区照明工程", "杭州滨江区市政配套"]
+UNITS = ["国丰建设有限公司", "华腾工程集团", "蝶泉市政", "某某科技有限公司", "ACME Engineering"]
+
+
+def make_index(path: str, rows: int) -> None:
+    from openpyxl import Workbook
+    rnd = random.Random(20240101)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("索引")
+    ws.append(HEADER)
+    start = datetime.date(2015, 1, 1)
+    for i in range(1, rows + 1):
+        amount = round(rnd.uniform(1000, 5000000), 2)
+        paid = amount if rnd.random() < 0.4 else round(amount * rnd.random(), 2)
+        signed = start + datetime.timedelta(days=rnd.randrange(3650))
+        ws.append([
+            f"{rnd.choice(PARTIES)}-{signed.year % 100:02d}-{i:06d}",
+            f"{rnd.choice(PLACES)}（第{i}标段）",
+            rnd.choice(UNITS),
+            "公开招标",
+            signed.strftime("%Y-%m-%d"),
+            signed.strftime("%Y-%m-%d"),
+            signed if rnd.random() < 0.5 else signed.strftime("%Y.%m.%d"),
+            round(amount * 1.1, 2),
+            amount,
+            amount if rnd.random() < 0.7 else "",
+            paid,
+            round(amount - paid, 2),
+            "",
+        ])
+    wb.save(path)
+
+
+def timed(fn, repeat: int):
+    best, result = None, None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--file", default="", help="使用现有 xlsx 而不是生成合成索引")
+    args = ap.parse_args()
+
+    tmpdir = None
+    path = args.file
+    if not path:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, "index.xlsx")
+        t = time.perf_counter()
+        make_index(path, args.rows)
+        print(f"生成 {args.rows} 行合成索引：{time.perf_counter() - t:.2f}s，{os.path.getsize(path) / 1e6:.1f} MB")
+
+    def parse(reader):
+        app.CONFIG["xlsx_reader"] = reader
+        return app._parse_excel_file(path)
+
+    # 只计读取：跳过逐行的日期/金额规范化与 PDF 匹配（两种读取方式共用的那部分）
+    finish = app._finish_row_item
+    app._finish_row_item = lambda item, x, row_idx, pdf_index: item
+    try:
+        r_old, _ = timed(lambda: parse("openpyxl"), args.repeat)
+        r_new, _ = timed(lambda: parse("stream"), args.repeat)
+    finally:
+        app._finish_row_item = finish
+    print(f"[读取]   openpyxl read_only : {r_old:.3f}s   xlsx_stream : {r_new:.3f}s   加速比 {r_old / r_new:.2f}x")
+
+    t_old, rows_old = timed(lambda: parse("openpyxl"), args.repeat)
+    t_new, rows_new = timed(lambda: parse("stream"), args.repeat)
+    print(f"[端到端] openpyxl read_only : {t_old:.3f}s   xlsx_stream : {t_new:.3f}s   加速比 {t_old / t_new:.2f}x"
+          f"（{len(rows_new)} 行）")
+    print("结果一致" if rows_old == rows_new else "结果不一致！")
+    if tmpdir is not None:
+        tmpdir.cleanup()
+    return 0 if rows_old == rows_new else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""独立索引进程：监听 roots，解析 index.xlsx（复用 app.py 的表头映射、日期/金额规范化与 PDF 匹配），
+把合并后的行缓存原子发布为 DATA/rows_shared.bin。Web 进程以 PDFSEARCH_INDEXER=external 启动时只映射已发布快照。
+
+用法：
+  python bin/indexer.py            # 常驻，文件变化后重新发布
+  python bin/indexer.py --once     # 发布一次后退出
+"""
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def log(msg: str) -> None:
+    print(f"[{time.strftime('%F %T')}] {msg}", flush=True)
+
+
+def publish_once() -> bool:
+    """行缓存过期则增量重建；新签名尚未发布时发布。返回是否发布了新快照"""
+    plan = app._rows_plan()
+    if plan is None:
+        return False
+    started = time.time()
+    lock = app._process_lock("rows_build.lock")
+    try:
+        view = app._rows_build_local(plan)
+        if app._map_shared_rows(view["sig"]) is not None:
+            return False
+        app._publish_shared_rows(view)
+    finally:
+        if lock is not None:
+            lock.close()
+    log(f"已发布 {len(view['rows'])} 行，签名 {view['sig'][:12]}，耗时 {time.time() - started:.2f}s")
+    return True
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--once", action="store_true", help="发布一次后退出")
+    ap.add_argument("--interval", type=float, default=1.0, help="监听器在线时的检查间隔（秒）")
+    args = ap.parse_args()
+
+    # 本进程就是解析方：按 index_config.json 跟进 Web 端 reload 的配置，自己不走 external 分支
+    app.CONFIG["indexer"] = "inline"
+    app.CONFIG["shared_snapshot"] = True
+
+    if args.once:
+        publish_once()
+        return 0
+
+    owner = app._process_lock("indexer.lock", blocking=False)
+    if owner is None:
+        log("已有索引进程在运行，退出")
+        return 1
+    log(f"索引进程启动 pid={os.getpid()}")
+    while True:
+        try:
+            publish_once()
+        except Exception as exc:
+            log(f"发布失败: {exc!r}")
+        # 监听器在线时检查是免费的；离线时每次检查都是一次全量签名扫描，按轮询间隔放慢
+        watching = app._watch_snapshot() is not None
+        time.sleep(args.interval if watching else max(args.interval, float(app.CONFIG.get("watch_poll_interval", 5) or 5)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
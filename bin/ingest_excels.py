@@ -504,6 +504,35 @@ def load_pending_rows(xlsx_path: Path, header_mode: str):
     return True, "", rows_out, headers_seen, errors
 
 
+def acquire_index_lock(lock: Path, timeout: float = 5.0) -> Optional[float]:
+    """<index.xlsx>.lock：O_EXCL 原子创建并写入 pid（与 app.py 写回备注共用）；持有者已退出的锁视为残留。
+    返回等待秒数，超时返回 None"""
+    waited = 0.0
+    while True:
+        try:
+            fd = os.open(str(lock), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                pid = int(lock.read_text(encoding="utf-8").strip() or 0)
+            except (OSError, ValueError):
+                pid = 0
+            if pid:
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    try: lock.unlink()
+                    except OSError: pass
+                    continue
+                except OSError:
+                    pass
+            if waited > timeout:
+                return None
+            time.sleep(0.1); waited += 0.1
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+        return waited
+
 def process_file(xlsx: Path, root: Path, header_mode: str):
     res={"file": xlsx.name, "added":0, "updated":0, "skipped":0, "invalid":0, "details":[]}
     ok, why, rows, headers_seen, sheet_errors = load_pending_rows(xlsx, header_mode)
@@ -530,13 +559,11 @@ def process_file(xlsx: Path, root: Path, header_mode: str):
             continue
         _log(f"process_file file={xlsx} year={year} rows={len(rows2)} index={idx_path}")
         lock = idx_path.with_name(idx_path.name + ".lock")
-        waited=0.0
-        while lock.exists():
-            import time as _t; _t.sleep(0.1); waited+=0.1
-            if waited>5.0: return {"file": xlsx.name, "__file_failed__": True, "reason": f"年索引被锁:{idx_path.name}"}
+        waited = acquire_index_lock(lock)
+        if waited is None:
+            return {"file": xlsx.name, "__file_failed__": True, "reason": f"年索引被锁:{idx_path.name}"}
         try:
             _log(f"process_file file={xlsx} year={year} acquiring_lock waited={waited:.1f}s")
-            lock.touch()
             start_ts = time.time()
             _log(f"process_file file={xlsx} year={year} merge_start rows={len(rows2)}")
             bak, added, updated = backup_and_merge(idx_path, rows2, year_headers, year_headers)
@@ -0,0 +1,5 @@
+#!/usr/bin/env bash
+set -e
+DIR="$(cd "$(dirname "$0")" && pwd)"
+source "$DIR/venv/bin/activate"
+exec python "$DIR/bin/indexer.py"
@@ -2,4 +2,6 @@
 set -e
 DIR="$(cd "$(dirname "$0")" && pwd)"
 source "$DIR/venv/bin/activate"
-exec uvicorn app:app --host 0.0.0.0 --port 9000 --workers 1
+# PDFSEARCH_WORKERS>1 时各 worker 共享 DATA/rows_shared.bin 行快照与 DATA/tokens 登录令牌
+export PDFSEARCH_WORKERS="${PDFSEARCH_WORKERS:-1}"
+exec uvicorn app:app --host 0.0.0.0 --port 9000 --workers "$PDFSEARCH_WORKERS"
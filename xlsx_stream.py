@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""index.xlsx 流式读取：直接从 zip 中 iterparse 活动工作表，共享字符串与 styles.xml 数字格式只解析一次，
+不构造 openpyxl 的单元格对象，只产出调用方需要的列。
+
+结果与 openpyxl load_workbook(read_only=True, data_only=True) 逐格一致（含 <dimension> 截断列/行、缺行补空、
+日期样式转 datetime、数字格式归一化）；遇到无法等价处理的结构抛 Unsupported，由调用方回退到 openpyxl。
+日期换算、内置格式表等纯函数直接复用 openpyxl.utils / openpyxl.styles.numbers。
+"""
+import posixpath
+import zipfile
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import fromstring, iterparse
+
+SHEET_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+
+_WORKBOOK_TYPES = {
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml",
+    "application/vnd.ms-excel.sheet.macroEnabled.main+xml",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.template.main+xml",
+    "application/vnd.ms-excel.template.macroEnabled.main+xml",
+}
+_SHARED_STRINGS_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+_WORKSHEET_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"
+
+_ROW = f"{{{SHEET_MAIN_NS}}}row"
+_V = f"{{{SHEET_MAIN_NS}}}v"
+_T = f"{{{SHEET_MAIN_NS}}}t"
+_R = f"{{{SHEET_MAIN_NS}}}r"
+_SI = f"{{{SHEET_MAIN_NS}}}si"
+_IS = f"{{{SHEET_MAIN_NS}}}is"
+_DIMENSION = f"{{{SHEET_MAIN_NS}}}dimension"
+_SHEET_DATA = f"{{{SHEET_MAIN_NS}}}sheetData"
+
+_BUILTIN_MAX = 164
+
+
+class Unsupported(Exception):
+    """工作簿结构超出流式读取的等价范围，应改用 openpyxl"""
+
+
+def _text_content(node) -> str:
+    """与 openpyxl Text.content 相同：纯文本 <t> 在前，富文本 <r><t> 依次拼接，忽略注音"""
+    plain = None
+    runs = []
+    for child in node:
+        if child.tag == _T:
+            plain = child.text
+        elif child.tag == _R:
+            t = child.find(_T)
+            if t is not None and t.text is not None:
+                runs.append(t.text)
+    return "".join(([plain] if plain is not None else []) + runs)
+
+
+def _read_rels(zf: zipfile.ZipFile, part: str) -> Dict[str, Tuple[str, str]]:
+    """part 的关系表 → {rId: (Type, zip 内绝对路径)}"""
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, "_rels", name + ".rels")
+    try:
+        root = fromstring(zf.read(rels_path))
+    except KeyError:
+        return {}
+    rels = {}
+    for rel in root.iter(f"{{{PKG_REL_NS}}}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        rels[rel.get("Id")] = (rel.get("Type", ""), target)
+    return rels
+
+
+def _read_styles(zf: zipfile.ZipFile) -> Tuple[List[Optional[str]], set, set]:
+    """cellXfs 下标 → 数字格式字符串（与 openpyxl cell.number_format 相同），以及日期/时长样式下标集合"""
+    from openpyxl.styles.numbers import (BUILTIN_FORMATS, BUILTIN_FORMATS_REVERSE, builtin_format_code,
+                                         is_date_format, is_timedelta_format)
+    try:
+        root = fromstring(zf.read("xl/styles.xml"))
+    except KeyError:
+        raise Unsupported("styles.xml missing")
+    custom = {}
+    numfmts = root.find(f"{{{SHEET_MAIN_NS}}}numFmts")
+    if numfmts is not None:
+        for nf in numfmts.findall(f"{{{SHEET_MAIN_NS}}}numFmt"):
+            custom[int(nf.get("numFmtId"))] = nf.get("formatCode")
+    formats: List[Optional[str]] = []
+    date_styles, timedelta_styles = set(), set()
+    xfs = root.find(f"{{{SHEET_MAIN_NS}}}cellXfs")
+    for idx, xf in enumerate(xfs.findall(f"{{{SHEET_MAIN_NS}}}xf") if xfs is not None else []):
+        num_fmt_id = int(xf.get("numFmtId", 0))
+        if num_fmt_id in custom:
+            fmt = custom[num_fmt_id]
+            if fmt in BUILTIN_FORMATS_REVERSE:
+                fmt = BUILTIN_FORMATS[BUILTIN_FORMATS_REVERSE[fmt]]
+            number_format = fmt
+        else:
+            fmt = builtin_format_code(num_fmt_id)
+            if num_fmt_id >= _BUILTIN_MAX:
+                raise Unsupported(f"numFmtId {num_fmt_id} undefined")
+            number_format = BUILTIN_FORMATS.get(num_fmt_id, "General")
+        formats.append(number_format)
+        if is_date_format(fmt):
+            date_styles.add(idx)
+        if is_timedelta_format(fmt):
+            timedelta_styles.add(idx)
+    return formats, date_styles, timedelta_styles
+
+
+def _read_shared_strings(zf: zipfile.ZipFile, path: Optional[str]) -> List[str]:
+    if not path:
+        return []
+    strings = []
+    with zf.open(path) as src:
+        for _, node in iterparse(src):
+            if node.tag == _SI:
+                strings.append(_text_content(node).replace("x005F_", ""))
+                node.clear()
+    return strings
+
+
+def _read_dimensions(zf: zipfile.ZipFile, path: str):
+    """<dimension> 的 (min_col, min_row, max_col, max_row)；按 schema 它位于 <sheetData> 之前，
+    用 start 事件读到 <sheetData> 即停（openpyxl 缺少 <dimension> 时会扫完整张表）"""
+    from openpyxl.utils.cell import range_boundaries
+    with zf.open(path) as src:
+        for _, el in iterparse(src, events=("start",)):
+            if el.tag == _DIMENSION:
+                return range_boundaries(el.get("ref"))
+            if el.tag == _SHEET_DATA:
+                return None
+    return None
+
+
+def open_active_sheet(path: str) -> Dict:
+    """打开工作簿并定位活动工作表（与 openpyxl wb.active 相同的选择规则）；用完调用 close()"""
+    zf = zipfile.ZipFile(path)
+    try:
+        names = set(zf.namelist())
+        manifest = fromstring(zf.read("[Content_Types].xml"))
+        wb_part = strings_part = None
+        for ov in manifest.iter(f"{{{CT_NS}}}Override"):
+            ct = ov.get("ContentType")
+            if wb_part is None and ct in _WORKBOOK_TYPES:
+                wb_part = ov.get("PartName", "")[1:]
+            elif strings_part is None and ct == _SHARED_STRINGS_TYPE:
+                strings_part = ov.get("PartName", "")[1:]
+        if not wb_part:
+            raise Unsupported("workbook part not found")
+
+        wb = fromstring(zf.read(wb_part))
+        epoch_1904 = False
+        pr = wb.find(f"{{{SHEET_MAIN_NS}}}workbookPr")
+        if pr is not None and pr.get("date1904") in ("1", "true"):
+            epoch_1904 = True
+        active = 0
+        views = wb.find(f"{{{SHEET_MAIN_NS}}}bookViews")
+        first_view = views.find(f"{{{SHEET_MAIN_NS}}}workbookView") if views is not None else None
+        if first_view is not None:
+            active = int(first_view.get("activeTab", 0))
+        rels = _read_rels(zf, wb_part)
+        sheets = []
+        sheets_el = wb.find(f"{{{SHEET_MAIN_NS}}}sheets")
+        for sheet in (sheets_el.findall(f"{{{SHEET_MAIN_NS}}}sheet") if sheets_el is not None else []):
+            rel = rels.get(sheet.get(f"{{{REL_NS}}}id"))
+            if rel is not None and rel[1] in names:
+                sheets.append(rel)
+        if not 0 <= active < len(sheets) or sheets[active][0] != _WORKSHEET_REL:
+            raise Unsupported("active sheet is not a worksheet")
+        sheet_path = sheets[active][1]
+
+        formats, date_styles, timedelta_styles = _read_styles(zf)
+        from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+        return {"zip": zf, "path": sheet_path, "shared": _read_shared_strings(zf, strings_part),
+                "formats": formats, "date_styles": date_styles, "timedelta_styles": timedelta_styles,
+                "epoch": CALENDAR_MAC_1904 if epoch_1904 else CALENDAR_WINDOWS_1900,
+                "dims": _read_dimensions(zf, sheet_path)}
+    except Exception:
+        zf.close()
+        raise
+
+
+def close(sheet: Dict) -> None:
+    sheet["zip"].close()
+
+
+def number_format(sheet: Dict, style_id: int) -> str:
+    """样式下标 → 数字格式字符串（等同 openpyxl 的 cell.number_format）"""
+    return sheet["formats"][style_id]
+
+
+_COL_CACHE: Dict[str, int] = {}
+
+
+def _column_index(ref: str) -> int:
+    letters = ref.rstrip("0123456789")
+    col = _COL_CACHE.get(letters)
+    if col is None:
+        if not letters or not letters.isalpha() or not letters.isupper() or len(letters) > 3:
+            raise Unsupported(f"invalid cell reference {ref!r}")
+        col = 0
+        for ch in letters:
+            col = col * 26 + (ord(ch) - 64)
+        _COL_CACHE[letters] = col
+    return col
+
+
+def _cell_value(sheet: Dict, el, t: str, style_id: int):
+    """与 openpyxl WorkSheetParser.parse_cell（data_only=True）相同的取值与类型转换"""
+    if t == "inlineStr":
+        child = el.find(_IS)
+        return _text_content(child) if child is not None else None
+    value = el.findtext(_V, None) or None
+    if value is None:
+        return None
+    if t == "n":
+        value = float(value) if ("." in value or "E" in value or "e" in value) else int(value)
+        if style_id in sheet["date_styles"]:
+            from openpyxl.utils.datetime import from_excel
+            try:
+                value = from_excel(value, sheet["epoch"], timedelta=style_id in sheet["timedelta_styles"])
+            except (OverflowError, ValueError):
+                value = "#VALUE!"
+    elif t == "s":
+        value = sheet["shared"][int(value)]
+    elif t == "b":
+        value = bool(int(value))
+    elif t == "d":
+        from openpyxl.utils.datetime import from_ISO8601
+        value = from_ISO8601(value)
+    return value
+
+
+def _parsed_rows(sheet: Dict, columns) -> Iterator[Tuple[int, int, Dict[int, Tuple[object, int]]]]:
+    """逐个 <row> 产出 (行号, 末个单元格列号, {列下标(0 起): (值, 样式下标)})；columns 为空表示全部列"""
+    row_counter = 0
+    with sheet["zip"].open(sheet["path"]) as src:
+        for _, el in iterparse(src):
+            if el.tag != _ROW:
+                continue
+            r = el.get("r")
+            if r is not None:
+                try:
+                    row_counter = int(r)
+                except ValueError:
+                    val = float(r)
+                    if not val.is_integer():
+                        raise ValueError(f"{r} is not a valid row number")
+                    row_counter = int(val)
+            else:
+                row_counter += 1
+            col = 0
+            cells = {}
+            for c in el:
+                ref = c.get("r")
+                col = _column_index(ref) if ref else col + 1
+                if columns is None or (col - 1) in columns:
+                    style = c.get("s", 0)
+                    style_id = int(style) if style else 0
+                    cells[col - 1] = (_cell_value(sheet, c, c.get("t", "n"), style_id), style_id)
+            last_col = col
+            el.clear()
+            yield row_counter, last_col, cells
+
+
+def iter_rows(sheet: Dict, columns=None, min_row: int = 1, max_row: Optional[int] = None
+              ) -> Iterator[Tuple[int, int, Dict[int, Tuple[object, int]]]]:
+    """按 openpyxl ws.iter_rows(min_row=...) 的规则逐行产出 (行号, 行宽, {列下标: (值, 样式下标)})。
+    行宽 = <dimension> 的最大列（缺失时取该行末个单元格的列号），超出行宽的单元格被丢弃；
+    行宽内缺失的单元格不在字典中（对应 openpyxl 的 EmptyCell：值 None，number_format None）。
+    只产出 sheet 中实际存在的行；openpyxl 为缺行补出的空行由调用方按行号自行判断"""
+    dims = sheet["dims"]
+    max_col = dims[2] if dims is not None else None
+    if max_row is None and dims is not None:
+        max_row = dims[3]
+    counter = min_row
+    for idx, last_col, cells in _parsed_rows(sheet, columns):
+        if max_row is not None and idx > max_row:
+            break
+        if idx < counter:
+            continue
+        counter = idx + 1
+        if not last_col and not max_col:
+            yield idx, 0, {}
+            continue
+        width = max_col or last_col
+        if any(k >= width for k in cells):
+            cells = {k: v for k, v in cells.items() if k < width}
+        yield idx, width, cells
+
+
+def read_header(sheet: Dict) -> List[object]:
+    """第 1 行各列的值（等同 openpyxl 的 [c.value for c in ws[1]]）"""
+    dims = sheet["dims"]
+    max_col = dims[2] if dims is not None else None
+    for idx, width, cells in iter_rows(sheet, None, min_row=1, max_row=1):
+        return [cells[i][0] if i in cells else None for i in range(width)]
+    # 第 1 行缺失：后面有行时 openpyxl 补出一行空单元格；整张表没有行时 ws[1] 抛 IndexError
+    for _ in _parsed_rows(sheet, ()):
+        return [None] * max_col if max_col is not None else []
+    raise IndexError("tuple index out of range")